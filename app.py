@@ -16,6 +16,8 @@ import torch
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from utils.grammar_analyzer import GrammarAnalyzer
 from utils.model_trainer import ModelTrainer
+from gec_inference import (MicroBatcher, SentenceCache, ModelSlot, ModelVersion, model_identity,
+                           prepare_cpu_model, compare_model_variants, warm_up_model)
 
 app = Flask(__name__)
 
@@ -30,14 +32,47 @@ os.makedirs(training_data_dir, exist_ok=True)
 MODEL_NAME = "gec-t5"  # 可替換為其他語法糾正模型
 LOCAL_MODEL_PATH = os.path.join(model_dir, "grammar-model-latest")
 
-if os.path.exists(LOCAL_MODEL_PATH):
-    print(f"Loading model from {LOCAL_MODEL_PATH}")
-    tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_PATH)
-    model = AutoModelForSeq2SeqLM.from_pretrained(LOCAL_MODEL_PATH)
-else:
-    print(f"Loading pretrained model: {MODEL_NAME}")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+
+
+def prepare_generation_model(fp32_model, tokenizer, base_id):
+    """
+    依 GEC_QUANTIZE / GEC_NUM_THREADS 環境變數準備推論用模型
+    啟用 int8 量化時先在樣本句子上與 fp32 模型比較，結果會顯示在 /health
+    """
+    served_model, variant = prepare_cpu_model(fp32_model)
+    check = None
+    if served_model is not fp32_model:
+        check = compare_model_variants(fp32_model, served_model, tokenizer)
+        print(f"Quantized model check: {check}")
+        # 量化模型的輸出可能與 fp32 不同，快取鍵需區分
+        base_id = f"{base_id}#{variant}"
+    return served_model, variant, check, base_id
+
+
+def load_model_version(name_or_path):
+    """
+    載入並預熱一個模型版本，連同建立在其上的語法分析器
+    /reload-model 在背景執行緒呼叫，執行期間原本的模型照常服務
+    """
+    tokenizer = AutoTokenizer.from_pretrained(name_or_path)
+    model = AutoModelForSeq2SeqLM.from_pretrained(name_or_path)
+    model, variant, check, model_id = prepare_generation_model(model, tokenizer, model_identity(name_or_path))
+    warm_up_model(model, tokenizer)
+
+    # 與其他版本共用同一個微批次排程，但請求固定使用此版本的模型
+    generator = generation_batcher.bind(model, tokenizer, model_id)
+    return ModelVersion(
+        model, tokenizer, model_id,
+        generator=generator,
+        service=GrammarAnalyzer(nlp, tokenizer, generator),
+        info={'source': name_or_path, 'variant': variant, 'quantization_check': check}
+    )
+
+
+def activate_model_version(version, old_version):
+    """新版本開始服務後，讓未固定版本的呼叫也改用新模型，並清除舊模型的快取結果"""
+    generation_batcher.update_model(version.model, version.tokenizer, version.model_id)
+
 
 # 載入spaCy用於語法分析
 try:
@@ -47,8 +82,23 @@ except:
     os.system("python -m spacy download en_core_web_lg")
     nlp = spacy.load("en_core_web_lg")
 
-# 初始化語法分析器
-grammar_analyzer = GrammarAnalyzer(nlp, tokenizer, model)
+# 糾正結果快取，容量與持久化檔案可由 GEC_CACHE_MAX_BYTES / GEC_CACHE_PATH 環境變數設定
+sentence_cache = SentenceCache()
+
+# 微批次排程：並行請求合併成一次補齊長度的 generate，已快取的輸入不再送進模型
+# 批次大小與最長等待時間可由 GEC_MAX_BATCH_SIZE / GEC_MAX_WAIT_MS 環境變數設定
+generation_batcher = MicroBatcher(None, None, cache=sentence_cache, model_id='unloaded')
+
+if os.path.exists(LOCAL_MODEL_PATH):
+    print(f"Loading model from {LOCAL_MODEL_PATH}")
+    initial_version = load_model_version(LOCAL_MODEL_PATH)
+else:
+    print(f"Loading pretrained model: {MODEL_NAME}")
+    initial_version = load_model_version(MODEL_NAME)
+generation_batcher.update_model(initial_version.model, initial_version.tokenizer, initial_version.model_id)
+
+# 目前服務中的模型版本；每個請求開始時取得一次，模型替換不影響處理中的請求
+model_slot = ModelSlot(initial_version, on_swap=activate_model_version)
 model_trainer = ModelTrainer(model_dir, training_data_dir)
 
 @app.route('/health', methods=['GET'])
@@ -57,7 +107,12 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'model': MODEL_NAME if not os.path.exists(LOCAL_MODEL_PATH) else 'custom-model',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'variant': model_slot.current.info.get('variant'),
+        'num_threads': torch.get_num_threads(),
+        'quantization_check': model_slot.current.info.get('quantization_check'),
+        'batching': generation_batcher.stats(),
+        'cache': sentence_cache.stats()
     })
 
 @app.route('/analyze', methods=['POST'])
@@ -73,7 +128,8 @@ def analyze_grammar():
     
     # 進行語法分析
     try:
-        results = grammar_analyzer.analyze(text)
+        with model_slot.acquire() as version:
+            results = version.service.analyze(text)
         return jsonify(results)
     except Exception as e:
         print(f"Error during analysis: {str(e)}")
@@ -109,20 +165,44 @@ def finetune_model():
 
 @app.route('/reload-model', methods=['POST'])
 def reload_model():
-    """重新載入最新模型"""
-    global tokenizer, model
-    
+    """
+    在背景重新載入最新模型，載入期間原本的模型照常服務
+
+    預設立即返回 202 (status: accepted)，進度請查詢 /reload-status；
+    已有重新載入進行中時返回 409。
+    加上 ?wait=1 時等到載入結束才返回：成功為 200 (status: success)，失敗為 500，
+    與改為背景載入之前的同步行為相同。
+    """
     try:
         latest_model_dir = model_trainer.get_latest_model_dir()
         if latest_model_dir and os.path.exists(latest_model_dir):
-            tokenizer = AutoTokenizer.from_pretrained(latest_model_dir)
-            model = AutoModelForSeq2SeqLM.from_pretrained(latest_model_dir)
-            grammar_analyzer.update_model(tokenizer, model)
-            
+            started = model_slot.reload(lambda: load_model_version(latest_model_dir), source=latest_model_dir)
+            if not started:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'A model reload is already in progress',
+                    'reload': model_slot.status()
+                }), 409
+
+            if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+                status = model_slot.wait_reload()
+                if status['state'] != 'completed':
+                    return jsonify({
+                        'status': 'error',
+                        'message': status.get('error', 'Model reload failed'),
+                        'reload': status
+                    }), 500
+                return jsonify({
+                    'status': 'success',
+                    'message': f'Model reloaded from {latest_model_dir}',
+                    'reload': status
+                })
+
             return jsonify({
-                'status': 'success',
-                'message': f'Model reloaded from {latest_model_dir}'
-            })
+                'status': 'accepted',
+                'message': f'Reloading model from {latest_model_dir}',
+                'reload': model_slot.status()
+            }), 202
         else:
             return jsonify({
                 'status': 'error',
@@ -134,6 +214,11 @@ def reload_model():
             'message': str(e)
         }), 500
 
+@app.route('/reload-status', methods=['GET'])
+def reload_status():
+    """模型重新載入狀態"""
+    return jsonify(model_slot.status())
+
 if __name__ == '__main__':
     # 開發環境使用
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
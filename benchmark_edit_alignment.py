@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+編輯擷取效能測試 - 比較 edit_extraction 的 Myers 單詞比對與原本 SequenceMatcher 比對
+
+以 dev.src 與 dev.ref0 逐行比對，分別測試：
+- 速度：只擷取編輯（兩種比對方式）與完整的 identify_differences（含錯誤分類）
+- 一致性：以原本 identify_differences 的結果為基準，計算 Myers 比對的編輯在同一行中
+  相同 (原始片段, 更正片段) 的精確率、召回率與 F1，以及整行編輯完全相同的比例
+
+用法: python benchmark_edit_alignment.py [--src dev.src] [--ref dev.ref0] [--limit 0] [--show 5]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+from edit_extraction import REPLACE, extract_edits
+from process_asap_data import (DevFile, _difflib_edits, detect_encoding, identify_differences,
+                               iter_dev_lines, load_dev_files)
+
+
+def myers_edits(src, ref):
+    """與 identify_differences 相同的處理：只取替換類型的編輯並轉成小寫"""
+    return [(edit.original, edit.corrected)
+            for edit in extract_edits(src.lower(), ref.lower()) if edit.type == REPLACE]
+
+
+def load_pairs(src_path, ref_path, limit):
+    """讀取需要比對的 (源句子, 參考句子)：略過空白與相同的句子"""
+    if src_path and ref_path:
+        data = {'src': DevFile(src_path, detect_encoding(src_path)),
+                'refs': [DevFile(ref_path, detect_encoding(ref_path))]}
+    else:
+        data = load_dev_files(['dev.src', 'dev.ref0'])
+    if not data['src'] or not data['refs']:
+        return []
+
+    pairs = []
+    for src, (ref,) in iter_dev_lines(data['src'], data['refs'][:1]):
+        src = src.strip()
+        ref = ref.strip() if ref is not None else ''
+        if src and ref and src != ref:
+            pairs.append((src, ref))
+            if limit and len(pairs) >= limit:
+                break
+    return pairs
+
+
+def time_call(func, pairs, repeat):
+    """對所有句子執行 repeat 次並返回最短時間（秒）"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for src, ref in pairs:
+            func(src, ref)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare_edits(pairs, show):
+    """以 SequenceMatcher 的結果為基準，統計 Myers 比對的編輯一致性"""
+    matched = baseline_total = myers_total = identical_lines = 0
+    shown = 0
+    for src, ref in pairs:
+        baseline = Counter(_difflib_edits(src, ref))
+        candidate = Counter(myers_edits(src, ref))
+        matched += sum((baseline & candidate).values())
+        baseline_total += sum(baseline.values())
+        myers_total += sum(candidate.values())
+        if baseline == candidate:
+            identical_lines += 1
+        elif shown < show:
+            shown += 1
+            print(f"\n源句子: {src}\n參考句子: {ref}")
+            print(f"  SequenceMatcher: {sorted(baseline.elements())}")
+            print(f"  Myers:           {sorted(candidate.elements())}")
+
+    precision = matched / myers_total if myers_total else 1.0
+    recall = matched / baseline_total if baseline_total else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'lines': len(pairs),
+        'identical_lines': identical_lines,
+        'baseline_edits': baseline_total,
+        'myers_edits': myers_total,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較 Myers 單詞比對與 SequenceMatcher 的速度與編輯一致性')
+    parser.add_argument('--src', help='源句子檔案（預設為資料目錄中的 dev.src）')
+    parser.add_argument('--ref', help='參考句子檔案（預設為資料目錄中的 dev.ref0）')
+    parser.add_argument('--limit', type=int, default=0, help='最多比對的句子數 (0 為全部)')
+    parser.add_argument('--repeat', type=int, default=1, help='每項測試重複次數（取最短時間）')
+    parser.add_argument('--show', type=int, default=5, help='顯示幾個編輯不一致的例子')
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.src, args.ref, args.limit)
+    if not pairs:
+        print("沒有可比對的句子")
+        return
+    print(f"比對 {len(pairs)} 組不同的句子")
+
+    print(f"\n{'項目':<28} {'SequenceMatcher (s)':>20} {'Myers (s)':>10} {'speedup':>8}")
+    rows = [
+        ('擷取編輯', _difflib_edits, myers_edits),
+        ('identify_differences', lambda s, r: identify_differences(s, r, aligner='difflib'),
+         lambda s, r: identify_differences(s, r, aligner='myers'))
+    ]
+    for name, baseline, candidate in rows:
+        baseline_time = time_call(baseline, pairs, args.repeat)
+        candidate_time = time_call(candidate, pairs, args.repeat)
+        print(f"{name:<28} {baseline_time:>20.3f} {candidate_time:>10.3f} {baseline_time / candidate_time:>7.2f}x")
+
+    stats = compare_edits(pairs, args.show)
+    print("\n編輯一致性（以 SequenceMatcher 的結果為基準）:")
+    print(f"整行編輯完全相同: {stats['identical_lines']}/{stats['lines']} "
+          f"({stats['identical_lines'] / stats['lines']:.1%})")
+    print(f"編輯數: SequenceMatcher {stats['baseline_edits']}，Myers {stats['myers_edits']}")
+    print(f"精確率: {stats['precision']:.4f}  召回率: {stats['recall']:.4f}  F1: {stats['f1']:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+平行運算效能測試 - 比較不同 worker 數下隨機森林的擬合與預測時間
+
+以合成資料模擬 ASAP 資料集的規模（約 13,000 篇作文、8 個 essay_set），分別測試：
+- 作文評分模型：train_model.py 的特徵與 RandomForestRegressor 設定
+- 文法問題分類器：grammar_analyzer.py 的 TF-IDF 與 RandomForestClassifier 設定
+
+用法: python benchmark_parallel.py [--essays 12976] [--jobs 1 2 4 -1] [--repeat 1]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from parallel_config import effective_n_jobs
+from train_model import clean_text, extract_features
+
+# ASAP training_set_rel3.tsv 的作文篇數
+ASAP_ESSAY_COUNT = 12976
+
+ISSUE_TYPES = ['subject_verb_agreement', 'tense', 'article', 'plural', 'preposition']
+
+
+def synthetic_essays(count, rng):
+    """產生長度與標點分布近似學生作文的合成文本"""
+    vocabulary = [''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), size=rng.integers(2, 10)))
+                  for _ in range(5000)]
+    essays = []
+    for _ in range(count):
+        words = rng.choice(vocabulary, size=rng.integers(150, 650))
+        sentences = np.array_split(words, max(1, len(words) // 18))
+        essays.append(' '.join(' '.join(sentence) + rng.choice(['.', '.', '.', '?', '!']) for sentence in sentences))
+    return essays
+
+
+def time_call(func, repeat):
+    """執行 repeat 次並返回最短時間（秒）"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(name, make_model, X, y, X_predict, jobs, repeat):
+    print(f"\n{name} (訓練 {X.shape[0]} 筆，預測 {X_predict.shape[0]} 筆)")
+    print(f"{'n_jobs':>8} {'cores':>6} {'fit (s)':>10} {'predict (s)':>12} {'fit speedup':>12}")
+    baseline = None
+    for n_jobs in jobs:
+        model = make_model(n_jobs)
+        fit_time = time_call(lambda: model.fit(X, y), repeat)
+        predict_time = time_call(lambda: model.predict(X_predict), repeat)
+        baseline = baseline or fit_time
+        print(f"{n_jobs:>8} {effective_n_jobs(n_jobs):>6} {fit_time:>10.3f} {predict_time:>12.3f} {baseline / fit_time:>11.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較不同 worker 數下的模型擬合與預測時間')
+    parser.add_argument('--essays', type=int, default=ASAP_ESSAY_COUNT, help='合成作文篇數')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, -1], help='要測試的 n_jobs 值')
+    parser.add_argument('--repeat', type=int, default=1, help='每項測試重複次數（取最短時間）')
+    args = parser.parse_args()
+
+    # 重複的核心數只測一次（例如只有 4 核時 4 與 -1 相同）
+    jobs = []
+    for n_jobs in args.jobs:
+        if effective_n_jobs(n_jobs) not in [effective_n_jobs(j) for j in jobs]:
+            jobs.append(n_jobs)
+
+    rng = np.random.default_rng(42)
+    print(f"CPU 核心數: {os.cpu_count()}，產生 {args.essays} 篇合成作文...")
+    essays = synthetic_essays(args.essays, rng)
+
+    # 作文評分模型
+    features = pd.DataFrame([extract_features(clean_text(essay)) for essay in essays])
+    scores = rng.integers(0, 13, size=len(essays)).astype(float)
+    benchmark(
+        '作文評分模型 RandomForestRegressor',
+        lambda n_jobs: RandomForestRegressor(n_estimators=100, max_depth=10, random_state=42, n_jobs=n_jobs),
+        features, scores, features, jobs, args.repeat
+    )
+
+    # 文法問題分類器：每篇作文取一段錯誤上下文
+    contexts = [essay[start:start + 120] for essay, start in
+                zip(essays, rng.integers(0, 600, size=len(essays)))]
+    labels = rng.choice(ISSUE_TYPES, size=len(contexts))
+    X = TfidfVectorizer(max_features=5000).fit_transform(contexts)
+    benchmark(
+        '文法問題分類器 RandomForestClassifier',
+        lambda n_jobs: RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs),
+        X, labels, X, jobs, args.repeat
+    )
+
+
+if __name__ == '__main__':
+    main()
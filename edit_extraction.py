@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+編輯擷取模組 - 以 Myers O(ND) 差異演算法比對原始句子與校正句子的單詞
+
+原本的 find_diff_regions 把單詞與空白、標點連續片段一起交給 difflib.SequenceMatcher，
+長句子時很慢，autojunk 等啟發式規則也會讓對齊結果不穩定。這裡改為：
+
+1. 句子切成單詞與標點符號 (空白不算詞元)，每個詞元記錄在原文中的字元位置；
+   比對時不分大小寫。
+2. 先去掉相同的開頭與結尾，再以 Myers 演算法求最短編輯序列，
+   耗時與「句子長度 × 編輯數」成正比，結果只取決於輸入，不受啟發式規則影響。
+3. 相鄰的刪除與插入合併成一個編輯區段；兩邊詞元數相同的區段再拆成逐詞的替換
+   (例如 "to book" -> "went books" 為兩個編輯)。返回 EditSpan：
+   類型 (replace / insert / delete)、原始與校正文字，以及兩邊的字元位置。
+"""
+
+import re
+from collections import namedtuple
+
+# 詞元：單詞或單一標點符號，空白不算詞元
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+# 編輯類型
+REPLACE = 'replace'
+INSERT = 'insert'
+DELETE = 'delete'
+
+# 詞元與其在原文中的字元位置 [start, end)
+Token = namedtuple('Token', ['text', 'start', 'end'])
+
+# 編輯區段：original / corrected 為原文中的片段（插入時 original 為空字串，刪除時 corrected 為空字串），
+# src_start/src_end 與 ref_start/ref_end 為兩邊的字元位置
+EditSpan = namedtuple('EditSpan', ['type', 'original', 'corrected',
+                                   'src_start', 'src_end', 'ref_start', 'ref_end'])
+
+
+def tokenize(text):
+    """將文字切成詞元列表"""
+    return [Token(match.group(), match.start(), match.end()) for match in TOKEN_RE.finditer(text)]
+
+
+def myers_opcodes(a, b):
+    """
+    以 Myers O(ND) 演算法比對兩個序列，返回不相同的區段 [(i1, i2, j1, j2), ...]
+    a[i1:i2] 對應 b[j1:j2]；相鄰的刪除與插入合併為同一個區段
+    """
+    # 相同的開頭與結尾不需要進入演算法
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+
+    a_mid = a[prefix:len(a) - suffix]
+    b_mid = b[prefix:len(b) - suffix]
+    n, m = len(a_mid), len(b_mid)
+    if n == 0 and m == 0:
+        return []
+    if n == 0 or m == 0:
+        return [(prefix, prefix + n, prefix, prefix + m)]
+
+    # v[k + offset] 為對角線 k 上目前走得最遠的 x；
+    # trace[d] 保存第 d 步開始前對角線 -d-1 … d+1 的值（回溯時只會用到這個範圍）
+    max_d = n + m
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        done = False
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1 + offset] < v[k + 1 + offset]):
+                x = v[k + 1 + offset]
+            else:
+                x = v[k - 1 + offset] + 1
+            y = x - k
+            while x < n and y < m and a_mid[x] == b_mid[y]:
+                x += 1
+                y += 1
+            v[k + offset] = x
+            if x >= n and y >= m:
+                done = True
+                break
+        if done:
+            break
+
+    # 回溯出每一步的編輯，標記原始與校正序列中未對齊的位置
+    a_changed = [False] * n
+    b_changed = [False] * m
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        band = trace[d]
+        k = x - y
+        if k == -d or (k != d and band[k + d] < band[k + d + 2]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = band[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        # 走回對角線 (相同的詞元)
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+        if x == prev_x:
+            b_changed[prev_y] = True
+        else:
+            a_changed[prev_x] = True
+        x, y = prev_x, prev_y
+
+    _shift_changes(a_mid, a_changed, b_mid, b_changed)
+    return [(prefix + i1, prefix + i2, prefix + j1, prefix + j2)
+            for i1, i2, j1, j2 in _changed_regions(a_mid, a_changed, b_mid, b_changed)]
+
+
+def _changed_regions(a, a_changed, b, b_changed):
+    """把連續的變更位置組成區段；兩邊以相同的詞元為界同步前進"""
+    regions = []
+    i = j = 0
+    n, m = len(a), len(b)
+    while i < n or j < m:
+        if i < n and j < m and not a_changed[i] and not b_changed[j]:
+            i += 1
+            j += 1
+            continue
+        i1, j1 = i, j
+        while i < n and a_changed[i]:
+            i += 1
+        while j < m and b_changed[j]:
+            j += 1
+        regions.append((i1, i, j1, j))
+    return regions
+
+
+def _alignment_cost(a, a_changed, b, b_changed):
+    """(區段數, 單詞與標點互相替換的次數)：越小越好"""
+    regions = _changed_regions(a, a_changed, b, b_changed)
+    mismatched = sum(1 for i1, i2, j1, j2 in regions
+                     for i, j in zip(range(i1, i2), range(j1, j2))
+                     if a[i][:1].isalnum() != b[j][:1].isalnum())
+    return len(regions), mismatched
+
+
+def _move_run(changed, from_start, to_start, length):
+    for k in range(from_start, from_start + length):
+        changed[k] = False
+    for k in range(to_start, to_start + length):
+        changed[k] = True
+
+
+def _shift_changes(a, a_changed, b, b_changed):
+    """
+    在相同詞元之間平移連續的變更，盡量讓刪除與插入相鄰成為替換
+    (例如 "is is" -> "are is" 可能被對齊成「插入 are、刪除第二個 is」，平移後為 is -> are)
+    只在移出與移入的詞元相同時平移，未變更的詞元序列不變，因此仍是最短編輯序列
+    """
+    for seq, changed in ((a, a_changed), (b, b_changed)):
+        i = 0
+        while i < len(seq):
+            if not changed[i]:
+                i += 1
+                continue
+            start = i
+            while i < len(seq) and changed[i]:
+                i += 1
+            end = i
+            length = end - start
+
+            # 可以平移到的起點：往前或往後經過的詞元必須與移出的詞元相同
+            candidates = []
+            s, e = start, end
+            while s > 0 and not changed[s - 1] and seq[s - 1] == seq[e - 1]:
+                s, e = s - 1, e - 1
+                candidates.append(s)
+            s, e = start, end
+            while e < len(seq) and not changed[e] and seq[s] == seq[e]:
+                s, e = s + 1, e + 1
+                candidates.append(s)
+            if not candidates:
+                continue
+
+            best_cost = _alignment_cost(a, a_changed, b, b_changed)
+            best_start = start
+            for candidate in candidates:
+                _move_run(changed, start, candidate, length)
+                cost = _alignment_cost(a, a_changed, b, b_changed)
+                if cost < best_cost:
+                    best_cost, best_start = cost, candidate
+                _move_run(changed, candidate, start, length)
+            _move_run(changed, start, best_start, length)
+            i = max(i, best_start + length)
+
+
+def _span_offsets(tokens, start, end, text):
+    """詞元區段 [start, end) 在原文中的字元位置；空區段為插入點（下一個詞元的開頭）"""
+    if start < end:
+        return tokens[start].start, tokens[end - 1].end
+    position = tokens[start].start if start < len(tokens) else len(text)
+    return position, position
+
+
+def extract_edits(src, ref, src_tokens=None, ref_tokens=None):
+    """比對原始句子與校正句子，返回 EditSpan 列表（依在句子中的位置排序）"""
+    if src_tokens is None:
+        src_tokens = tokenize(src)
+    if ref_tokens is None:
+        ref_tokens = tokenize(ref)
+
+    src_keys = [token.text.lower() for token in src_tokens]
+    ref_keys = [token.text.lower() for token in ref_tokens]
+
+    regions = []
+    for i1, i2, j1, j2 in myers_opcodes(src_keys, ref_keys):
+        if i2 - i1 == j2 - j1 > 1:
+            # 詞元數相同時逐詞對應，每個不同的詞元各為一個替換
+            regions.extend((i, i + 1, j, j + 1) for i, j in zip(range(i1, i2), range(j1, j2))
+                           if src_keys[i] != ref_keys[j])
+        else:
+            regions.append((i1, i2, j1, j2))
+
+    edits = []
+    for i1, i2, j1, j2 in regions:
+        src_start, src_end = _span_offsets(src_tokens, i1, i2, src)
+        ref_start, ref_end = _span_offsets(ref_tokens, j1, j2, ref)
+        if i1 == i2:
+            edit_type = INSERT
+        elif j1 == j2:
+            edit_type = DELETE
+        else:
+            edit_type = REPLACE
+        edits.append(EditSpan(edit_type, src[src_start:src_end], ref[ref_start:ref_end],
+                              src_start, src_end, ref_start, ref_end))
+    return edits
@@ -14,10 +14,14 @@ This module provides enhanced grammar checking functionality by:
 import re
 import sys
 import os
-import pickle
 import json
 from collections import defaultdict
 import argparse
+import contextlib
+
+import grammar_batch
+import grammar_daemon
+from grammar_rule_engine import CompiledRuleEngine, get_compiled_engine, load_rule_engine, split_rules_data
 
 # Error type descriptions (both English and Chinese)
 ERROR_DESCRIPTIONS = {
@@ -34,90 +38,45 @@ ERROR_DESCRIPTIONS = {
     "unknown": "其他錯誤 (Other Error)"
 }
 
-def load_grammar_rules(rules_path=None):
-    """Load grammar rules from pickle file"""
-    # If path is specified, try to load from it
-    if rules_path and os.path.exists(rules_path):
-        try:
-            print(f"Loading grammar rules from: {rules_path}")
-            with open(rules_path, 'rb') as f:
-                data = pickle.load(f)
-                if isinstance(data, dict):
-                    if "rules" in data:
-                        return data
-                    else:
-                        return {"rules": data, "descriptions": ERROR_DESCRIPTIONS}
-        except Exception as e:
-            print(f"Error loading grammar rules: {e}", file=sys.stderr)
-    
-    # Try to load from default locations
-    possible_paths = [
-        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
-        os.path.join('models', 'grammar_rules.pkl'),
-        os.path.join(os.path.dirname(__file__), '..', 'models', 'grammar_rules.pkl'),
-        os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
-    ]
+# Default grammar rules locations
+DEFAULT_RULES_PATHS = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
+    os.path.join('models', 'grammar_rules.pkl'),
+    os.path.join(os.path.dirname(__file__), '..', 'models', 'grammar_rules.pkl'),
+    os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
+]
+
+def load_compiled_rules(rules_path=None):
+    """Load the compiled rule engine, using the rule index file instead of unpickling when it is fresh"""
+    paths = ([rules_path] if rules_path else []) + DEFAULT_RULES_PATHS
     
-    for path in possible_paths:
+    for path in paths:
         if os.path.exists(path):
             try:
                 print(f"Loading grammar rules from: {path}")
-                with open(path, 'rb') as f:
-                    data = pickle.load(f)
-                    if isinstance(data, dict):
-                        if "rules" in data:
-                            return data
-                        else:
-                            return {"rules": data, "descriptions": ERROR_DESCRIPTIONS}
+                return load_rule_engine(path)
             except Exception as e:
                 print(f"Error loading grammar rules from {path}: {e}", file=sys.stderr)
     
-    # If all paths fail, return empty rules structure
+    # If all paths fail, return an empty engine
     print("No grammar rules found, returning empty rules", file=sys.stderr)
-    return {"rules": {}, "descriptions": ERROR_DESCRIPTIONS}
+    return CompiledRuleEngine()
 
 def check_grammar_issues(text, grammar_rules=None):
-    """Check for grammar issues in the text using the provided rules"""
+    """Check for grammar issues in the text using the provided rules (a rules dict or a compiled engine)"""
     # If rules not provided, load them
     if grammar_rules is None:
-        grammar_rules = load_grammar_rules()
+        grammar_rules = load_compiled_rules()
+    
+    rules = grammar_rules.get("rules") if isinstance(grammar_rules, dict) else grammar_rules
     
     # If no rules available after loading, try basic grammar patterns
-    if not grammar_rules or not grammar_rules.get("rules"):
+    if not rules:
         return check_basic_english_grammar(text)
     
-    issues = {}
-    
-    # Go through each error type and its rules
-    for error_type, rules in grammar_rules.get("rules", {}).items():
-        found_issues = []
-        
-        for rule in rules:
-            if not rule.get('original'):
-                continue
-            
-            original = rule['original']
-            
-            # Use different matching strategies for phrases vs. single words
-            if ' ' in original:
-                # For phrases, create a pattern allowing for flexible word boundaries
-                pattern = r'(?i)\b' + re.escape(original).replace(r'\ ', r'\s+') + r'\b'
-            else:
-                # For single words, use simpler word boundary match
-                pattern = r'(?i)\b' + re.escape(original) + r'\b'
-            
-            # Find all matches
-            matches = re.findall(pattern, text)
-            
-            if matches:
-                corrected = rule.get('corrected', [""])[0] if rule.get('corrected') else ""
-                suggestion = f"'{original}' 可能應為 '{corrected}'"
-                
-                if suggestion not in found_issues:
-                    found_issues.append(suggestion)
-        
-        if found_issues:
-            issues[error_type] = found_issues
+    # Scan the text once with the compiled rule engine (rules are compiled only once)
+    engine = get_compiled_engine(rules)
+    issues = engine.find_issues(text, flexible_whitespace=True, require_corrected=False)
     
     # If no issues found with rules, try basic grammar checks
     if not issues:
@@ -210,10 +169,17 @@ def check_basic_english_grammar(text):
     
     return issues
 
-def analyze_text(text, rules_path=None):
+def analyze_text(text, rules_path=None, grammar_rules=None):
     """Complete text analysis including grammar, statistics, and feedback"""
-    # Load grammar rules
-    grammar_rules = load_grammar_rules(rules_path)
+    # Load grammar rules (unless an already compiled engine is provided)
+    if grammar_rules is None:
+        grammar_rules = load_compiled_rules(rules_path)
+    
+    # Accept both a compiled engine and a plain rules dict ({"rules": ..., "descriptions": ...} or flat)
+    if isinstance(grammar_rules, CompiledRuleEngine):
+        descriptions = grammar_rules.descriptions
+    else:
+        _, descriptions = split_rules_data(grammar_rules)
     
     # Check grammar issues
     grammar_issues = check_grammar_issues(text, grammar_rules)
@@ -245,7 +211,7 @@ def analyze_text(text, rules_path=None):
             "avg_sentence_length": avg_sentence_length,
             "lexical_diversity": lexical_diversity
         },
-        "descriptions": grammar_rules.get("descriptions", ERROR_DESCRIPTIONS)
+        "descriptions": descriptions if descriptions is not None else ERROR_DESCRIPTIONS
     }
     
     return analysis
@@ -345,6 +311,57 @@ def generate_feedback(analysis, score=None, category=None):
     
     return "\n".join(feedback)
 
+# Per-process analysis state for batch and parallel analysis, set up once per worker
+_analysis_state = {}
+
+def _init_analysis_worker(rules_path=None, options=None, redirect_stdout=True):
+    """Load the compiled rules once per worker process (from the memory-mapped rule index)"""
+    if redirect_stdout:
+        # Keep worker diagnostics off stdout, which carries the JSONL results
+        sys.stdout = sys.stderr
+    _analysis_state['rules'] = load_compiled_rules(rules_path)
+    _analysis_state['options'] = options or {}
+
+def _analyze_record(text, record):
+    """Analyze one essay with the rules loaded by _init_analysis_worker"""
+    options = _analysis_state['options']
+    analysis = analyze_text(text, grammar_rules=_analysis_state['rules'])
+    if options.get('feedback'):
+        analysis["feedback"] = generate_feedback(
+            analysis, record.get('score', options.get('score')), record.get('category', options.get('category')))
+    return analysis
+
+def _analysis_results(items, rules_path=None, workers=1, options=None):
+    """Analyze (id, record) items in-process or over a process pool, yielding results in input order"""
+    with contextlib.redirect_stdout(sys.stderr):
+        # Builds (or refreshes) the rule index before any worker starts, so workers only read it
+        _init_analysis_worker(rules_path, options, redirect_stdout=False)
+    
+    if workers and workers > 1:
+        return grammar_batch.process_batch_parallel(
+            items, _analyze_record, workers, _init_analysis_worker, (rules_path, options))
+    return grammar_batch.process_batch(items, _analyze_record)
+
+def analyze_texts(texts, rules_path=None, workers=None, feedback=False, score=None, category=None):
+    """
+    Analyze many essays, spreading them over a process pool of `workers` processes
+    (defaults to the CPU count). Results are returned in input order; an essay that
+    fails yields {"success": False, "error": ...} instead of aborting the whole run.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    options = {'feedback': feedback, 'score': score, 'category': category}
+    items = ((index, {'text': text}) for index, text in enumerate(texts))
+    return [result for _, result in _analysis_results(items, rules_path, workers, options)]
+
+def run_batch_analysis(args):
+    """Analyze every essay of a batch source with rules loaded once per process, streaming JSONL to stdout"""
+    options = {'feedback': args.feedback, 'score': args.score, 'category': args.category}
+    items = grammar_batch.iter_batch_inputs(args.batch)
+    total, failed = grammar_batch.write_batch_results(_analysis_results(items, args.rules, args.workers, options))
+    print(f"Batch finished: {total} essays, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
 def main():
     """Main function to handle command line usage"""
     parser = argparse.ArgumentParser(description='Grammar Analysis Tool')
@@ -355,9 +372,21 @@ def main():
     parser.add_argument('-s', '--score', type=int, help='Score for feedback generation')
     parser.add_argument('-c', '--category', help='Essay category')
     parser.add_argument('--feedback', action='store_true', help='Generate human-readable feedback')
+    parser.add_argument('--serve', action='store_true', help='Run as a resident service that keeps rules loaded')
+    parser.add_argument('--port', type=int, default=grammar_daemon.DEFAULT_PORT, help='Port of the resident service')
+    parser.add_argument('--no-daemon', action='store_true', help='Do not use the resident service, analyze in-process')
+    parser.add_argument('-b', '--batch', help='Batch mode: a directory, a glob pattern, or - for JSONL on stdin; writes one JSON line per essay')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes for batch mode')
     
     args = parser.parse_args()
     
+    if args.serve:
+        grammar_daemon.serve(port=args.port, rules_path=args.rules)
+        return 0
+    
+    if args.batch:
+        return run_batch_analysis(args)
+    
     # Get text content
     text = ""
     if args.file:
@@ -373,13 +402,25 @@ def main():
         print("No text provided. Use -f/--file or -t/--text", file=sys.stderr)
         return 1
     
-    # Analyze text
-    analysis = analyze_text(text, args.rules)
-    
-    # Generate feedback if requested
-    if args.feedback:
-        feedback = generate_feedback(analysis, args.score, args.category)
-        analysis["feedback"] = feedback
+    # Hand the request to the resident service first, fall back to in-process analysis
+    analysis = None
+    if not args.no_daemon:
+        analysis = grammar_daemon.request_daemon('enhanced_feedback', {
+            'text': text,
+            'rules': os.path.abspath(args.rules) if args.rules else None,
+            'score': args.score,
+            'category': args.category,
+            'feedback': args.feedback
+        }, port=args.port)
+    
+    if analysis is None:
+        # Analyze text
+        analysis = analyze_text(text, args.rules)
+        
+        # Generate feedback if requested
+        if args.feedback:
+            feedback = generate_feedback(analysis, args.score, args.category)
+            analysis["feedback"] = feedback
     
     # Output results
     if args.output:
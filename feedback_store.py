@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+教師反饋儲存區 - 分段的只附加 JSONL 檔
+
+原本每次提交反饋都寫成一個 feedback_<時間戳>.json，同一秒內的兩次提交會互相覆蓋，
+訓練時也必須列出並逐一解析所有檔案。這裡改為：
+
+- 每筆反饋附加成一行 JSON 寫入目前的分段檔 (feedback-000001.jsonl …)，
+  分段超過大小上限時換新檔；寫入成本與已累積的反饋數量無關。
+- 每筆紀錄有唯一的 id；fsync 以批次方式執行（累積一定筆數或經過一定時間），
+  不必每次提交都等待磁碟。
+- 讀取端依序串流所有分段，並以游標 ("分段編號:位元組位置") 記錄讀到哪裡，
+  下次可以只讀取之後新增的紀錄。游標可以用名稱保存在儲存區中。
+
+寫入時整行以一次 write 附加 (O_APPEND)，多個行程同時寫入同一分段也不會交錯。
+多個 worker 行程共用同一個儲存區：每次附加前在跨行程的鎖定檔 (segments.lock) 下
+重新檢查目前的分段與其大小，某個行程換新分段後，其他行程也會改寫到新分段，
+不會有紀錄寫進游標已經讀過的舊分段。
+
+建立儲存區時指定 legacy_directory，會在 migrate.lock 下匯入其中舊版的反饋檔
+（每個 worker 行程開啟儲存區時都會檢查，但每個檔案只會匯入一次）。
+"""
+
+import atexit
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# 分段檔名稱與大小上限
+SEGMENT_PREFIX = 'feedback-'
+SEGMENT_SUFFIX = '.jsonl'
+SEGMENT_RE = re.compile(r'^feedback-(\d{6})\.jsonl$')
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+# fsync 批次設定：累積 FSYNC_EVERY 筆或距離上次 fsync 超過 FSYNC_INTERVAL 秒
+DEFAULT_FSYNC_EVERY = int(os.environ.get('FEEDBACK_FSYNC_EVERY', '32'))
+DEFAULT_FSYNC_INTERVAL = float(os.environ.get('FEEDBACK_FSYNC_INTERVAL', '1.0'))
+
+# 游標檔存放的子目錄
+CURSOR_DIR = 'cursors'
+
+# 跨行程鎖定檔：換分段與附加紀錄、匯入舊版反饋檔
+SEGMENT_LOCK_NAME = 'segments.lock'
+MIGRATE_LOCK_NAME = 'migrate.lock'
+
+
+def segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+
+def format_cursor(segment, offset):
+    return f"{segment}:{offset}"
+
+
+def parse_cursor(cursor):
+    """游標字串轉成 (分段編號, 位元組位置)；None 表示從頭開始"""
+    if not cursor:
+        return 0, 0
+    segment, offset = str(cursor).split(':', 1)
+    return int(segment), int(offset)
+
+
+@contextmanager
+def file_lock(path):
+    """以鎖定檔在行程之間互斥（POSIX 使用 flock，Windows 使用 msvcrt.locking）"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.name == 'nt':
+            while True:
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 重試約 10 秒後仍失敗會引發 OSError，繼續等待
+                    continue
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class FeedbackStore:
+    """分段的只附加反饋紀錄"""
+
+    def __init__(self, directory, segment_max_bytes=DEFAULT_SEGMENT_MAX_BYTES,
+                 fsync_every=DEFAULT_FSYNC_EVERY, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 legacy_directory=None):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.lock_path = os.path.join(directory, SEGMENT_LOCK_NAME)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._fd = None
+        self._segment = None
+        self._size = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+        # 背景執行緒定期 fsync，尚未同步的紀錄最多只會延遲 fsync_interval 秒
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, name='feedback-fsync', daemon=True)
+        self._syncer.start()
+        atexit.register(self.close)
+
+        if legacy_directory:
+            migrate_legacy_files(self, legacy_directory)
+
+    def segments(self):
+        """返回目前所有分段的編號（由小到大）"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, segment_name(number))
+
+    def _open_segment(self):
+        """開啟最新的分段（已超過大小上限時建立新分段）；呼叫端必須持有跨行程鎖定"""
+        numbers = self.segments()
+        number = numbers[-1] if numbers else 1
+        path = self.segment_path(number)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            number += 1
+            path = self.segment_path(number)
+
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self._fd = os.open(path, flags, 0o644)
+        self._segment = number
+        self._size = os.fstat(self._fd).st_size
+
+    def _ensure_current_segment(self):
+        """
+        確認目前開啟的是最新且未滿的分段；呼叫端必須持有跨行程鎖定
+        其他行程可能已換新分段（下一個分段檔已存在），或已把目前分段寫滿
+        """
+        if self._fd is not None:
+            self._size = os.fstat(self._fd).st_size
+            if (self._size < self.segment_max_bytes
+                    and not os.path.exists(self.segment_path(self._segment + 1))):
+                return
+        self._close_segment()
+        self._open_segment()
+
+    def _close_segment(self):
+        if self._fd is not None:
+            if self._pending:
+                os.fsync(self._fd)
+                self._pending = 0
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, data):
+        """附加一筆反饋，返回紀錄（包含 id 與寫入時間）"""
+        record = {
+            'id': uuid.uuid4().hex,
+            'received_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'data': data
+        }
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+        with self._lock, file_lock(self.lock_path):
+            self._ensure_current_segment()
+            os.write(self._fd, line)
+            self._size += len(line)
+            self._pending += 1
+
+            if (self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+
+        return record
+
+    def _sync_locked(self):
+        if self._fd is not None and self._pending:
+            os.fsync(self._fd)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        """立即 fsync 尚未同步的紀錄"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"反饋紀錄同步失敗: {e}", file=sys.stderr)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._close_segment()
+
+    def iter_records(self, cursor=None):
+        """
+        從游標位置依序讀取紀錄，逐筆產生 (讀取後的游標, 紀錄)
+
+        最新分段結尾尚未寫完的一行（沒有換行字元）不會被讀取，下次從同一位置重讀；
+        較舊的分段已不會再寫入，結尾不完整的一行（例如寫入中行程異常結束）直接略過。
+        無法解析的行會略過。
+        """
+        start_segment, start_offset = parse_cursor(cursor)
+
+        numbers = self.segments()
+        for number in numbers:
+            if number < start_segment:
+                continue
+            offset = start_offset if number == start_segment else 0
+            active = number == numbers[-1]
+
+            with open(self.segment_path(number), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        if active:
+                            return
+                        print(f"略過不完整的反饋紀錄 ({segment_name(number)})", file=sys.stderr)
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except ValueError as e:
+                        print(f"略過無法解析的反饋紀錄 ({segment_name(number)}): {e}", file=sys.stderr)
+                        continue
+                    yield format_cursor(number, offset), record
+
+    def _cursor_path(self, name):
+        return os.path.join(self.directory, CURSOR_DIR, f"{name}.json")
+
+    def load_cursor(self, name):
+        """讀取以名稱保存的游標；不存在時返回 None（從頭開始）"""
+        try:
+            with open(self._cursor_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f).get('cursor')
+        except (OSError, ValueError):
+            return None
+
+    def save_cursor(self, name, cursor):
+        """以名稱保存游標（先寫暫存檔再替換）"""
+        path = self._cursor_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'cursor': cursor, 'saved_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+        os.replace(tmp_path, path)
+
+
+def migrate_legacy_files(store, directory, pattern='feedback_*.json'):
+    """
+    將舊版每次提交一個的反饋檔依檔名順序匯入儲存區，匯入後改名為 .migrated
+    返回匯入的筆數
+
+    在跨行程鎖定下執行，多個行程同時呼叫時每個檔案只會匯入一次；
+    檔案已被其他行程處理（不存在）時略過。
+    """
+    count = 0
+    if not glob.glob(os.path.join(directory, pattern)):
+        return count
+    with file_lock(os.path.join(store.directory, MIGRATE_LOCK_NAME)):
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                print(f"讀取反饋檔案時發生錯誤: {path}: {e}", file=sys.stderr)
+                continue
+            store.append(data)
+            try:
+                os.replace(path, path + '.migrated')
+            except FileNotFoundError:
+                pass
+            count += 1
+        if count:
+            store.flush()
+    return count
+
+
+def main():
+    """命令列：python feedback_store.py <舊版反饋檔目錄> [儲存區目錄]，匯入舊版反饋檔"""
+    if len(sys.argv) < 2:
+        print("用法: python feedback_store.py <舊版反饋檔目錄> [儲存區目錄]")
+        sys.exit(1)
+    directory = sys.argv[1]
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(directory, 'feedback')
+    store = FeedbackStore(store_dir)
+    try:
+        count = migrate_legacy_files(store, directory)
+    finally:
+        store.close()
+    print(f"已匯入 {count} 筆舊版反饋")
+
+
+if __name__ == '__main__':
+    main()
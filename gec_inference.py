@@ -0,0 +1,833 @@
+# -*- coding: utf-8 -*-
+"""
+文法糾正模型推論工具
+
+MicroBatcher 放在 seq2seq 模型前面：同時進來的多個 generate() 呼叫會在數毫秒內
+被收集起來、補齊長度後合併成一次 generate，再把輸出依原本的呼叫拆回去。
+它對外提供與模型相同的介面（generate 以外的屬性直接轉給模型），
+因此可以直接取代 model 傳給 GrammarAnalyzer。
+
+correct_text 則把整篇作文以 spaCy 切成句子，依長度分組批次糾正後再依原本的
+字元位置組回全文，避免長作文在 512 個 token 處被截斷。
+
+SentenceCache 以 (模型識別, 正規化後的句子) 為鍵快取糾正結果，學生重新提交只改了
+一兩句的草稿時，只有改過的句子需要再送進模型。
+
+prepare_cpu_model 可在 CPU 上改用動態 int8 量化的模型副本，
+compare_model_variants 則在少量樣本上比較量化模型與 fp32 模型的輸出與速度。
+
+ModelSlot 負責模型熱替換：新模型在背景執行緒載入與預熱，完成後以單一參考替換；
+請求開始時取得當下的 ModelVersion 並一路使用到結束，舊版本在處理中的請求結束後才釋放。
+"""
+
+import atexit
+import collections
+import contextlib
+import difflib
+import gc
+import json
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+# 預設批次設定，可用環境變數覆寫
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get('GEC_MAX_BATCH_SIZE', '8'))
+DEFAULT_MAX_WAIT_MS = float(os.environ.get('GEC_MAX_WAIT_MS', '10'))
+
+# 逐句糾正時每個批次的句數與單句最大 token 數
+SENTENCE_BATCH_SIZE = 16
+MAX_SEQUENCE_LENGTH = 512
+
+# 句子快取的容量上限（位元組）與持久化檔案路徑（未設定時只保留在記憶體）
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get('GEC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+DEFAULT_CACHE_PATH = os.environ.get('GEC_CACHE_PATH') or None
+
+# 句子快取累積幾筆新項目後寫入檔案一次
+DEFAULT_CACHE_FLUSH_ENTRIES = int(os.environ.get('GEC_CACHE_FLUSH_ENTRIES', '64'))
+
+# 每筆快取項目除了內容以外的估計額外負擔
+_CACHE_ENTRY_OVERHEAD = 64
+
+# CPU 推論設定：GEC_QUANTIZE=int8 啟用動態量化，GEC_NUM_THREADS 設定 PyTorch 執行緒數
+DEFAULT_QUANTIZE = os.environ.get('GEC_QUANTIZE', '').lower()
+DEFAULT_NUM_THREADS = int(os.environ.get('GEC_NUM_THREADS', '0')) or None
+
+# 量化前後比較用的預設樣本（可用 GEC_QUANT_EVAL_FILE 指定每行一句的檔案）
+QUANTIZATION_CHECK_SENTENCES = [
+    "Yesterday I buyed a new book for my sister.",
+    "She write to her grandmother every week.",
+    "My brother and me went to the park after school.",
+    "There is many reasons why students should read more.",
+    "The childrens are playing in the garden.",
+    "I has finished my homework before dinner.",
+    "He don't like to wake up early on weekends.",
+    "We arrived to the station at five o'clock."
+]
+
+
+def normalize_sentence(sentence):
+    """快取鍵使用的句子正規化：合併連續空白並去除首尾空白（大小寫保持不變）"""
+    return re.sub(r'\s+', ' ', sentence).strip()
+
+
+def model_identity(name_or_path):
+    """
+    模型識別字串：本地目錄加上其中檔案的最新修改時間，權重更新後識別就會不同；
+    預訓練模型名稱則直接使用名稱
+    """
+    if name_or_path and os.path.isdir(name_or_path):
+        latest = max((entry.stat().st_mtime_ns for entry in os.scandir(name_or_path) if entry.is_file()), default=0)
+        return f"{os.path.abspath(name_or_path)}@{latest}"
+    return str(name_or_path)
+
+
+class SentenceCache:
+    """
+    以位元組數為上限的 LRU 句子快取
+
+    設定 path 時，新項目先暫存在記憶體，累積 flush_entries 筆後在鎖外一次附加寫入 JSONL 檔，
+    重新啟動時讀回（行程結束時也會寫出剩下的項目）。
+    檔案超過 max_file_bytes（預設為 max_bytes 的兩倍）時改寫為只包含目前的項目，
+    因此檔案大小不會無限增長；clear() 會同時清空檔案，用於模型更換後使所有舊結果失效。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES, path=DEFAULT_CACHE_PATH,
+                 flush_entries=DEFAULT_CACHE_FLUSH_ENTRIES, max_file_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes or 2 * max_bytes
+        self.path = path
+        self.flush_entries = max(1, flush_entries)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._pending = []
+        self._file_bytes = 0
+        self._lock = threading.Lock()
+        # 檔案寫入另外以 _file_lock 互斥，寫檔時不會擋住 get/put
+        self._file_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self._load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _entry_size(key, value):
+        return len(key[0]) + len(key[1].encode('utf-8')) + len(json.dumps(value, ensure_ascii=False).encode('utf-8')) + _CACHE_ENTRY_OVERHEAD
+
+    @staticmethod
+    def _record_line(key, value):
+        return json.dumps({'m': key[0], 's': key[1], 'v': value}, ensure_ascii=False) + '\n'
+
+    def _store(self, key, value):
+        """寫入項目並依 LRU 淘汰超出容量的舊項目（呼叫端需持有鎖）"""
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        size = self._entry_size(key, value)
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, model_id, sentence):
+        key = (model_id, normalize_sentence(sentence))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, model_id, sentence, value):
+        key = (model_id, normalize_sentence(sentence))
+        with self._lock:
+            self._store(key, value)
+            if not self.path:
+                return
+            self._pending.append((key, value))
+            if len(self._pending) < self.flush_entries:
+                return
+        # 已有其他執行緒正在寫檔時不必等待，剩下的項目留到下一次寫出
+        if self._file_lock.acquire(blocking=False):
+            try:
+                self._flush_locked()
+            finally:
+                self._file_lock.release()
+
+    def flush(self):
+        """將暫存的新項目寫入快取檔"""
+        if not self.path:
+            return
+        with self._file_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        """寫出暫存項目（呼叫端需持有 _file_lock）；檔案超過上限時改寫為目前的項目"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        data = ''.join(self._record_line(key, value) for key, value in pending).encode('utf-8')
+        try:
+            if self._file_bytes + len(data) > self.max_file_bytes:
+                self._compact()
+            else:
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+                self._file_bytes += len(data)
+        except OSError as e:
+            print(f"寫入句子快取檔失敗: {e}", file=sys.stderr)
+
+    def _compact(self):
+        """
+        將快取檔改寫為目前記憶體中的項目（呼叫端需持有 _file_lock）
+        由最新的項目往回寫，總大小不超過 max_bytes，保證檔案不超過 max_file_bytes
+        """
+        with self._lock:
+            items = [(key, value) for key, (value, _) in self._entries.items()]
+
+        lines = []
+        total = 0
+        for key, value in reversed(items):
+            line = self._record_line(key, value).encode('utf-8')
+            if total + len(line) > self.max_bytes:
+                break
+            lines.append(line)
+            total += len(line)
+        lines.reverse()
+
+        # 多個行程共用同一個快取檔時，各自使用唯一的暫存檔
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.writelines(lines)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._file_bytes = total
+
+    def clear(self):
+        """清除所有項目（模型更換時呼叫）"""
+        with self._file_lock:
+            with self._lock:
+                self._entries.clear()
+                self._bytes = 0
+                self._pending = []
+            if self.path and os.path.exists(self.path):
+                open(self.path, 'w', encoding='utf-8').close()
+            self._file_bytes = 0
+
+    def _load(self):
+        """讀回快取檔，並改寫為只包含仍在容量內的項目"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._store((record['m'], record['s']), record['v'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+            with self._file_lock:
+                self._compact()
+        except OSError as e:
+            print(f"讀取句子快取檔失敗: {e}", file=sys.stderr)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'persistent': bool(self.path),
+                'pending_writes': len(self._pending),
+                'file_bytes': self._file_bytes
+            }
+
+
+def _same_kwargs(left, right):
+    """兩個 generate 呼叫的參數是否相同（相同才能合併成一批）"""
+    try:
+        return bool(left == right)
+    except Exception:
+        # 參數中含有張量等無法直接比較的值時不合併
+        return False
+
+
+# 模型、tokenizer 與模型識別一起替換，讀取時只需取得一個參考
+ModelBinding = collections.namedtuple('ModelBinding', 'model tokenizer model_id')
+
+
+def _binding_model_id(model, model_id=None):
+    return model_id or model_identity(getattr(getattr(model, 'config', None), '_name_or_path', ''))
+
+
+def _pad_token_id(binding):
+    if getattr(binding.tokenizer, 'pad_token_id', None) is not None:
+        return binding.tokenizer.pad_token_id
+    return getattr(binding.model.config, 'pad_token_id', None) or 0
+
+
+class _GenerateRequest:
+    def __init__(self, binding, input_ids, attention_mask, kwargs):
+        self.binding = binding
+        self.input_ids = input_ids
+        self.attention_mask = attention_mask
+        self.kwargs = kwargs
+        self.future = Future()
+
+    @property
+    def rows(self):
+        return self.input_ids.shape[0]
+
+
+class MicroBatcher:
+    """將並行的 generate 請求合併成補齊長度的批次"""
+
+    def __init__(self, model, tokenizer, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 cache=None, model_id=None):
+        self._binding = ModelBinding(model, tokenizer, _binding_model_id(model, model_id))
+        # 可選的句子快取；命中的輸入列不會再送進模型
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_count = 0
+        self._request_count = 0
+        self._row_count = 0
+
+        self._worker = threading.Thread(target=self._run, name='gec-micro-batcher', daemon=True)
+        self._worker.start()
+
+    def __getattr__(self, name):
+        # generate 以外的屬性（config、device 等）直接使用模型本身的
+        return getattr(self._binding.model, name)
+
+    @property
+    def model(self):
+        return self._binding.model
+
+    @property
+    def tokenizer(self):
+        return self._binding.tokenizer
+
+    @property
+    def model_id(self):
+        return self._binding.model_id
+
+    @property
+    def pad_token_id(self):
+        return _pad_token_id(self._binding)
+
+    def update_model(self, model, tokenizer, model_id=None):
+        """替換預設模型；已排入佇列或以 bind() 固定的請求仍使用原本的模型，舊模型的快取結果不再使用"""
+        self._binding = ModelBinding(model, tokenizer, _binding_model_id(model, model_id))
+        if self.cache is not None:
+            self.cache.clear()
+
+    def bind(self, model=None, tokenizer=None, model_id=None):
+        """返回固定使用指定模型（預設為目前模型）的 generate 代理，與其他請求共用批次排程"""
+        binding = self._binding
+        if model is not None:
+            binding = ModelBinding(model, tokenizer, _binding_model_id(model, model_id))
+        return BoundGenerator(self, binding)
+
+    def generate(self, inputs=None, attention_mask=None, **kwargs):
+        """與 model.generate 相同的呼叫方式；無法合併的呼叫直接交給模型"""
+        return self._generate(self._binding, inputs, attention_mask, kwargs)
+
+    def _generate(self, binding, inputs, attention_mask, kwargs):
+        input_ids = inputs if inputs is not None else kwargs.pop('input_ids', None)
+
+        if (not torch.is_tensor(input_ids) or input_ids.dim() != 2
+                or kwargs.get('return_dict_in_generate') or kwargs.get('output_scores')):
+            return binding.model.generate(input_ids, attention_mask=attention_mask, **kwargs)
+
+        if self.cache is not None and kwargs.get('num_return_sequences', 1) == 1:
+            return self._generate_cached(binding, input_ids, attention_mask, kwargs)
+        return self._submit(binding, input_ids, attention_mask, kwargs)
+
+    def _submit(self, binding, input_ids, attention_mask, kwargs):
+        request = _GenerateRequest(binding, input_ids, attention_mask, kwargs)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _generate_cached(self, binding, input_ids, attention_mask, kwargs):
+        """
+        依每一列解碼後的文字查詢快取，只把未命中的列送進批次，
+        最後把快取結果與新結果補齊成同一個輸出張量
+        """
+        tokenizer = binding.tokenizer
+        namespace = f"{binding.model_id}|{sorted(kwargs.items())!r}"
+        pad_token_id = _pad_token_id(binding)
+
+        keys = []
+        for row, ids in enumerate(input_ids):
+            if attention_mask is not None:
+                ids = ids[attention_mask[row].bool()]
+            keys.append(tokenizer.decode(ids, skip_special_tokens=True))
+
+        outputs = [self.cache.get(namespace, key) for key in keys]
+        missing = [row for row, output in enumerate(outputs) if output is None]
+        if missing:
+            generated = self._submit(
+                binding,
+                input_ids[missing],
+                attention_mask[missing] if attention_mask is not None else None,
+                kwargs
+            )
+            for row, tokens in zip(missing, generated.tolist()):
+                # 去掉批次補齊造成的結尾 padding，快取內容與單獨生成時相同
+                while len(tokens) > 1 and tokens[-1] == pad_token_id:
+                    tokens.pop()
+                outputs[row] = tokens
+                self.cache.put(namespace, keys[row], tokens)
+
+        width = max(len(tokens) for tokens in outputs)
+        padded = [tokens + [pad_token_id] * (width - len(tokens)) for tokens in outputs]
+        return torch.tensor(padded, dtype=input_ids.dtype, device=input_ids.device)
+
+    def _collect_batch(self):
+        """等待第一個請求，再於 max_wait_ms 內盡量收集同設定的請求"""
+        first = self._queue.get()
+        batch = [first]
+        rows = first.rows
+        deferred = []
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if (request.binding.model is first.binding.model and _same_kwargs(request.kwargs, first.kwargs)
+                    and rows + request.rows <= self.max_batch_size):
+                batch.append(request)
+                rows += request.rows
+            else:
+                deferred.append(request)
+
+        # 模型或設定不同、或放不下的請求放回佇列，下一輪處理
+        for request in deferred:
+            self._queue.put(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._generate_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _generate_batch(self, batch):
+        """補齊長度後執行一次 generate，並依各請求的列數拆分輸出"""
+        binding = batch[0].binding
+        model = binding.model
+        pad_token_id = _pad_token_id(binding)
+
+        max_length = max(request.input_ids.shape[1] for request in batch)
+        input_rows = []
+        mask_rows = []
+        for request in batch:
+            ids = request.input_ids
+            mask = request.attention_mask
+            if mask is None:
+                mask = torch.ones_like(ids)
+            padding = max_length - ids.shape[1]
+            if padding:
+                ids = torch.nn.functional.pad(ids, (0, padding), value=pad_token_id)
+                mask = torch.nn.functional.pad(mask, (0, padding), value=0)
+            input_rows.append(ids)
+            mask_rows.append(mask)
+
+        with torch.inference_mode():
+            outputs = model.generate(
+                torch.cat(input_rows, dim=0),
+                attention_mask=torch.cat(mask_rows, dim=0),
+                **batch[0].kwargs
+            )
+
+        # num_return_sequences > 1 時每個輸入列會對應多個輸出列
+        per_row = outputs.shape[0] // sum(request.rows for request in batch)
+        offset = 0
+        for request in batch:
+            count = request.rows * per_row
+            request.future.set_result(outputs[offset:offset + count])
+            offset += count
+
+        with self._lock:
+            self._batch_count += 1
+            self._request_count += len(batch)
+            self._row_count += offset // per_row
+
+    def stats(self):
+        """批次設定與統計（供 /health 使用）"""
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': self._batch_count,
+                'requests': self._request_count,
+                'avg_batch_size': round(self._row_count / self._batch_count, 2) if self._batch_count else 0,
+                'queued': self._queue.qsize(),
+                'model_id': self.model_id
+            }
+
+
+class BoundGenerator:
+    """固定使用某一個模型的 generate 代理；預設模型替換後，已取得代理的請求仍使用原本的模型"""
+
+    def __init__(self, batcher, binding):
+        self._batcher = batcher
+        self._binding = binding
+
+    def __getattr__(self, name):
+        return getattr(self._binding.model, name)
+
+    @property
+    def model_id(self):
+        return self._binding.model_id
+
+    def generate(self, inputs=None, attention_mask=None, **kwargs):
+        return self._batcher._generate(self._binding, inputs, attention_mask, kwargs)
+
+
+def split_sentences(doc):
+    """
+    以 spaCy 的斷句結果返回 [(起始字元, 結束字元, 句子), ...]
+
+    句子首尾的空白不算在句子內（保留在句子之間原樣輸出），只有空白的句子略過。
+    """
+    sentences = []
+    for sent in doc.sents:
+        text = sent.text
+        stripped = text.strip()
+        if not stripped:
+            continue
+        start = sent.start_char + (len(text) - len(text.lstrip()))
+        sentences.append((start, start + len(stripped), stripped))
+    return sentences
+
+
+def correct_sentences(sentences, tokenizer, model, batch_size=SENTENCE_BATCH_SIZE, max_length=MAX_SEQUENCE_LENGTH):
+    """
+    批次糾正句子列表，返回與輸入順序相同的糾正結果
+
+    句子先依長度排序再分批，同一批的句子長度相近，補齊的 padding 最少。
+    """
+    corrections = [None] * len(sentences)
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+
+    for begin in range(0, len(order), batch_size):
+        indices = order[begin:begin + batch_size]
+        inputs = tokenizer([sentences[i] for i in indices], return_tensors="pt", padding=True,
+                           max_length=max_length, truncation=True)
+        with torch.inference_mode():
+            outputs = model.generate(inputs.input_ids, attention_mask=inputs.attention_mask, max_length=max_length)
+        for i, corrected in zip(indices, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            corrections[i] = corrected
+
+    return corrections
+
+
+def correct_text(text, doc, tokenizer, model, batch_size=SENTENCE_BATCH_SIZE, max_length=MAX_SEQUENCE_LENGTH,
+                 cache=None, model_id=None):
+    """
+    逐句糾正整篇文章並組回全文
+
+    返回 (corrected_text, segments)；segments 中每句記錄原文位置 (start/end)
+    與糾正後全文中的位置 (corrected_start/corrected_end)，句子之間的空白與換行保持原樣。
+    提供 cache 時，只有快取中沒有的句子（同篇重複的句子只算一次）會送進模型。
+    """
+    sentences = split_sentences(doc)
+    texts = [sentence for _, _, sentence in sentences]
+
+    if cache is None:
+        corrections = correct_sentences(texts, tokenizer, model, batch_size, max_length)
+    else:
+        corrections = [cache.get(model_id, sentence) for sentence in texts]
+        pending = {}
+        for index, corrected in enumerate(corrections):
+            if corrected is None:
+                pending.setdefault(normalize_sentence(texts[index]), []).append(index)
+        if pending:
+            sources = [texts[indices[0]] for indices in pending.values()]
+            for indices, corrected in zip(pending.values(), correct_sentences(sources, tokenizer, model,
+                                                                               batch_size, max_length)):
+                cache.put(model_id, texts[indices[0]], corrected)
+                for index in indices:
+                    corrections[index] = corrected
+
+    pieces = []
+    segments = []
+    cursor = 0
+    corrected_length = 0
+    for (start, end, original), corrected in zip(sentences, corrections):
+        gap = text[cursor:start]
+        pieces.append(gap)
+        corrected_length += len(gap)
+
+        pieces.append(corrected)
+        segments.append({
+            'start': start,
+            'end': end,
+            'original': original,
+            'corrected': corrected,
+            'corrected_start': corrected_length,
+            'corrected_end': corrected_length + len(corrected)
+        })
+        corrected_length += len(corrected)
+        cursor = end
+    pieces.append(text[cursor:])
+
+    return ''.join(pieces), segments
+
+
+def _quantize_dynamic():
+    quantization = getattr(torch, 'ao', None)
+    quantization = getattr(quantization, 'quantization', None) or torch.quantization
+    return quantization.quantize_dynamic
+
+
+def prepare_cpu_model(model, quantize=DEFAULT_QUANTIZE, num_threads=DEFAULT_NUM_THREADS):
+    """
+    準備 CPU 推論用的模型，返回 (模型, 版本名稱)
+
+    quantize='int8' 時返回 Linear 層動態量化為 int8 的副本（原模型不變），否則返回原模型。
+    num_threads 設定 PyTorch 的執行緒數。
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model.eval()
+
+    if quantize == 'int8':
+        quantized = _quantize_dynamic()(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=False)
+        quantized.eval()
+        return quantized, 'int8-dynamic'
+    return model, 'fp32'
+
+
+def load_check_sentences(path=None):
+    """讀取量化比較用的樣本句子；未提供檔案時使用內建樣本"""
+    path = path or os.environ.get('GEC_QUANT_EVAL_FILE')
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            sentences = [line.strip() for line in f if line.strip()]
+        if sentences:
+            return sentences
+    return list(QUANTIZATION_CHECK_SENTENCES)
+
+
+def compare_model_variants(reference_model, candidate_model, tokenizer, sentences=None,
+                           batch_size=SENTENCE_BATCH_SIZE, max_length=MAX_SEQUENCE_LENGTH):
+    """
+    在樣本句子上比較兩個模型（通常是 fp32 與 int8）：
+    輸出完全相同的比例、平均字元相似度，以及兩者的耗時與加速比
+    """
+    sentences = sentences or load_check_sentences()
+
+    started = time.perf_counter()
+    reference = correct_sentences(sentences, tokenizer, reference_model, batch_size, max_length)
+    reference_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    candidate = correct_sentences(sentences, tokenizer, candidate_model, batch_size, max_length)
+    candidate_seconds = time.perf_counter() - started
+
+    exact = sum(1 for left, right in zip(reference, candidate) if left == right)
+    similarity = sum(difflib.SequenceMatcher(None, left, right).ratio() for left, right in zip(reference, candidate))
+
+    return {
+        'samples': len(sentences),
+        'exact_match': round(exact / len(sentences), 4),
+        'avg_similarity': round(similarity / len(sentences), 4),
+        'reference_seconds': round(reference_seconds, 3),
+        'candidate_seconds': round(candidate_seconds, 3),
+        'speedup': round(reference_seconds / candidate_seconds, 2) if candidate_seconds else None
+    }
+
+
+def warm_up_model(model, tokenizer, sentences=None, max_length=MAX_SEQUENCE_LENGTH):
+    """以少量句子先執行一次 generate，讓第一個真正的請求不必承擔初始化成本"""
+    correct_sentences(sentences or QUANTIZATION_CHECK_SENTENCES[:2], tokenizer, model, max_length=max_length)
+
+
+class ModelVersion:
+    """
+    一個已載入的模型版本
+
+    generator 為請求應使用的 generate 代理（例如 MicroBatcher.bind() 的結果），
+    service 為建立在此模型上的服務物件（例如 GrammarAnalyzer），info 為 /health 顯示的資訊。
+    """
+
+    def __init__(self, model, tokenizer, model_id, generator=None, service=None, info=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_id = model_id
+        self.generator = generator if generator is not None else model
+        self.service = service
+        self.info = info or {}
+        self.loaded_at = time.time()
+        self.active = 0
+        self.retired = False
+
+    def release(self):
+        """放開對模型的所有參考，讓記憶體可以被回收"""
+        self.model = None
+        self.tokenizer = None
+        self.generator = None
+        self.service = None
+
+    def describe(self):
+        description = {
+            'model_id': self.model_id,
+            'loaded_at': self.loaded_at,
+            'active_requests': self.active
+        }
+        description.update(self.info)
+        return description
+
+
+class ModelSlot:
+    """
+    持有目前服務中的 ModelVersion，並支援不中斷服務的背景重新載入
+
+    請求以 `with slot.acquire() as version:` 取得版本，整個請求都使用同一個版本；
+    替換只是改變一個參考，不會讓請求看到新舊混合的狀態。
+    被替換的舊版本在最後一個使用它的請求結束後才釋放。
+    """
+
+    def __init__(self, version, on_swap=None):
+        self._current = version
+        # 替換完成後呼叫 on_swap(new_version, old_version)
+        self._on_swap = on_swap
+        self._lock = threading.Lock()
+        self._draining = []
+        self._status = {'state': 'idle'}
+        # 目前這次重新載入結束時設定
+        self._reload_done = threading.Event()
+        self._reload_done.set()
+
+    @property
+    def current(self):
+        return self._current
+
+    @contextlib.contextmanager
+    def acquire(self):
+        with self._lock:
+            version = self._current
+            version.active += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.active -= 1
+                drained = version.retired and version.active == 0
+                if drained and version in self._draining:
+                    self._draining.remove(version)
+            if drained:
+                self._release(version)
+
+    def _release(self, version):
+        version.release()
+        gc.collect()
+
+    def swap(self, version):
+        """以新版本取代目前版本；返回舊版本"""
+        with self._lock:
+            old = self._current
+            self._current = version
+            old.retired = True
+            drained = old.active == 0
+            if not drained:
+                self._draining.append(old)
+        if self._on_swap is not None:
+            self._on_swap(version, old)
+        if drained:
+            self._release(old)
+        return old
+
+    def reload(self, load, source=None):
+        """
+        在背景執行緒呼叫 load() 建立新的 ModelVersion，完成後替換目前版本
+
+        立即返回；已有重新載入進行中時返回 False。進度由 status() 查詢，
+        需要等待完成時呼叫 wait_reload()。
+        """
+        with self._lock:
+            if self._status['state'] == 'loading':
+                return False
+            self._status = {'state': 'loading', 'source': source, 'started_at': time.time()}
+            self._reload_done = threading.Event()
+
+        thread = threading.Thread(target=self._reload, args=(load, source), name='gec-model-reload', daemon=True)
+        thread.start()
+        return True
+
+    def _reload(self, load, source):
+        started_at = time.time()
+        try:
+            version = load()
+            self.swap(version)
+            status = {'state': 'completed', 'model_id': version.model_id}
+        except Exception as e:
+            print(f"重新載入模型失敗: {e}", file=sys.stderr)
+            status = {'state': 'failed', 'error': str(e)}
+
+        status.update({
+            'source': source,
+            'started_at': started_at,
+            'finished_at': time.time(),
+            'seconds': round(time.time() - started_at, 2)
+        })
+        with self._lock:
+            self._status = status
+            self._reload_done.set()
+
+    def wait_reload(self, timeout=None):
+        """等待目前的重新載入結束並返回 status()；逾時時狀態仍為 loading"""
+        with self._lock:
+            done = self._reload_done
+        done.wait(timeout)
+        return self.status()
+
+    def status(self):
+        """重新載入狀態、目前版本與尚在處理請求的舊版本"""
+        with self._lock:
+            status = dict(self._status)
+            status['current'] = self._current.describe()
+            status['draining'] = [version.describe() for version in self._draining]
+        return status
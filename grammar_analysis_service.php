@@ -35,6 +35,32 @@ class GrammarAnalysisService {
         return $this->analyzeWithLocalRules($text, $category);
     }
     
+    /**
+     * 批次分析多篇文本，結果依輸入順序返回
+     * @param array $texts 要分析的文本列表
+     * @param string $category 作文類型 (可選)
+     * @return array 每篇文本的分析結果
+     */
+    public function analyzeGrammarBatch($texts, $category = 'narrative') {
+        $texts = array_values($texts);
+        
+        // 整批只呼叫一次 NLP 服務
+        if ($this->use_nlp_service && !empty($texts)) {
+            $nlp_results = $this->callNLPServiceBatch($texts, $category);
+            
+            if ($nlp_results !== null) {
+                return $nlp_results;
+            }
+        }
+        
+        // 如果 NLP 服務未啟用或調用失敗，逐篇使用本地規則
+        $results = [];
+        foreach ($texts as $text) {
+            $results[] = $this->analyzeWithLocalRules($text, $category);
+        }
+        return $results;
+    }
+    
     /**
      * 使用本地文法規則分析文法
      * @param string $text 要分析的文本
@@ -121,6 +147,62 @@ class GrammarAnalysisService {
         }
     }
     
+    /**
+     * 調用 NLP 服務的批次端點
+     * @param array $texts 要分析的文本列表
+     * @param string $category 作文類型
+     * @return array|null 依輸入順序的分析結果或 null（如果調用失敗）
+     */
+    private function callNLPServiceBatch($texts, $category) {
+        try {
+            $items = [];
+            foreach ($texts as $text) {
+                $items[] = [
+                    'text' => $text,
+                    'category' => $category
+                ];
+            }
+            
+            $ch = curl_init();
+            curl_setopt($ch, CURLOPT_URL, $this->nlp_service_url . '/api/analyze_grammar_batch');
+            curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+            curl_setopt($ch, CURLOPT_POST, true);
+            curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode(['texts' => $items]));
+            curl_setopt($ch, CURLOPT_HTTPHEADER, [
+                'Content-Type: application/json',
+                'Accept: application/json'
+            ]);
+            // 整批的超時時間隨篇數增加
+            curl_setopt($ch, CURLOPT_TIMEOUT, 10 + count($texts));
+            
+            $response = curl_exec($ch);
+            $status_code = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+            curl_close($ch);
+            
+            if ($status_code == 200 && $response) {
+                $data = json_decode($response, true);
+                
+                if (isset($data['results']) && count($data['results']) == count($texts)) {
+                    $results = [];
+                    foreach ($data['results'] as $result) {
+                        // 添加額外信息
+                        $result['summary'] = $this->generateSummary($result['grammar_issues']);
+                        $result['all_issues_count'] = $this->countTotalIssues($result['grammar_issues']);
+                        $results[] = $result;
+                    }
+                    return $results;
+                }
+            }
+            
+            error_log("NLP 批次服務調用失敗: HTTP {$status_code}, Response: {$response}");
+            return null;
+            
+        } catch (Exception $e) {
+            error_log('調用 NLP 批次服務時發生錯誤: ' . $e->getMessage());
+            return null;
+        }
+    }
+    
     /**
      * 載入文法規則
      * @return array 文法規則
@@ -420,15 +502,15 @@ class GrammarAnalysisService {
                 'Content-Type: application/json',
                 'Accept: application/json'
             ]);
-            curl_setopt($ch, CURLOPT_TIMEOUT, 300);  // 增加超時時間，訓練可能需要更長時間
+            curl_setopt($ch, CURLOPT_TIMEOUT, 10);  // 訓練在背景執行，請求會立即返回工作 ID
             
             // 執行請求
             $response = curl_exec($ch);
             $status_code = curl_getinfo($ch, CURLINFO_HTTP_CODE);
 			curl_close($ch);
             
-            // 檢查是否成功
-            if ($status_code == 200 && $response) {
+            // 檢查是否成功 (202: 已啟動背景訓練，409: 已有訓練進行中)
+            if (($status_code == 200 || $status_code == 202 || $status_code == 409) && $response) {
                 return json_decode($response, true);
             }
             
@@ -438,5 +520,42 @@ class GrammarAnalysisService {
             return false;
         }
     }
+    
+    /**
+     * 查詢訓練工作狀態
+     * @param string|null $job_id 工作 ID（省略時為最近一次）
+     * @return array|false 工作狀態，包含階段、範例數、經過時間與評估指標
+     */
+    public function getTrainingStatus($job_id = null) {
+        if (!$this->use_nlp_service) {
+            return false;
+        }
+        
+        try {
+            $url = $this->nlp_service_url . '/api/train_model';
+            if ($job_id !== null) {
+                $url .= '/' . rawurlencode($job_id);
+            }
+            
+            $ch = curl_init();
+            curl_setopt($ch, CURLOPT_URL, $url);
+            curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+            curl_setopt($ch, CURLOPT_HTTPHEADER, ['Accept: application/json']);
+            curl_setopt($ch, CURLOPT_TIMEOUT, 10);
+            
+            $response = curl_exec($ch);
+            $status_code = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+            curl_close($ch);
+            
+            if ($status_code == 200 && $response) {
+                return json_decode($response, true);
+            }
+            
+            return false;
+        } catch (Exception $e) {
+            error_log('查詢模型訓練狀態時發生錯誤: ' . $e->getMessage());
+            return false;
+        }
+    }
 }
 ?>
\ No newline at end of file
@@ -1,14 +1,19 @@
 from flask import Flask, request, jsonify
-import pickle
+import joblib
 import numpy as np
 import nltk
 from nltk.tokenize import word_tokenize
 import os
 import json
 import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
+import threading
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.ensemble import RandomForestClassifier
-import re
+from sklearn.linear_model import SGDClassifier
+from grammar_rule_engine import CompiledRuleEngine, file_sha256, load_rule_engine
+from feedback_store import FeedbackStore
+from training_jobs import TrainingBusyError, TrainingJobRunner
+from parallel_config import apply_n_jobs, get_n_jobs
 
 app = Flask(__name__)
 
@@ -24,19 +29,55 @@ if not os.path.exists(model_path):
 grammar_model_path = os.path.join(model_path, 'grammar_model.pkl')
 vectorizer_path = os.path.join(model_path, 'vectorizer.pkl')
 
+# 訓練資訊（同時是增量訓練的檢查點：讀到哪一筆反饋、距離上次完整重訓的次數）
+training_info_path = os.path.join(model_path, 'training_info.json')
+
+# 訓練模式：forest（預設，原本的 TF-IDF + 隨機森林完整重訓）、
+# incremental（只用上次檢查點之後的新反饋更新線上模型）、full（以全部反饋重訓線上模型）
+# 線上模型需明確指定（請求的 mode 參數或環境變數 GRAMMAR_TRAINING_MODE）才會使用
+DEFAULT_TRAINING_MODE = os.environ.get('GRAMMAR_TRAINING_MODE', 'forest')
+TRAINING_MODES = ('incremental', 'full', 'forest')
+
+# 連續增量更新達此次數後自動改為完整重訓，避免模型隨時間漂移
+FULL_REFIT_EVERY = int(os.environ.get('GRAMMAR_FULL_REFIT_EVERY', '30'))
+
+# 文法規則檔（與 score_essay.py 等共用），其中的規則會併入 detect_issues 的樣式表
+grammar_rules_path = os.path.join(model_path, 'grammar_rules.pkl')
+
+# 內建的檢測樣式：{問題類型: [(錯誤寫法, 建議寫法), ...]}
+DEFAULT_ISSUE_PATTERNS = {
+    'subject_verb_agreement': [
+        ('they is', 'they are'),
+        ('he are', 'he is'),
+        ('she are', 'she is'),
+        ('it are', 'it is')
+    ],
+    'tense': [
+        ('have went', 'have gone'),
+        ('has went', 'has gone'),
+        ('will went', 'will go')
+    ]
+}
+
 # 訓練資料儲存路徑
 training_data_path = os.path.join(os.path.dirname(__file__), 'data')
 if not os.path.exists(training_data_path):
     os.makedirs(training_data_path)
 
+# 教師反饋儲存區（只附加的 JSONL 分段檔）；舊版的 feedback_<時間戳>.json 在開啟儲存區時匯入
+feedback_store = FeedbackStore(os.path.join(training_data_path, 'feedback'), legacy_directory=training_data_path)
+
+# 背景訓練工作，狀態檔存放在 models/training_jobs
+training_runner = TrainingJobRunner(os.path.join(model_path, 'training_jobs'))
+
 # 載入模型 (如果存在)
 def load_models():
     try:
         if os.path.exists(grammar_model_path) and os.path.exists(vectorizer_path):
-            with open(grammar_model_path, 'rb') as f:
-                model = pickle.load(f)
-            with open(vectorizer_path, 'rb') as f:
-                vectorizer = pickle.load(f)
+            # 不使用 mmap_mode：scikit-learn 的決策樹載入時仍會把節點陣列複製到行程自己的記憶體，
+            # 映射並不能讓 worker 共用模型，反而會讓 Windows 上的 os.replace 在檔案被映射時失敗
+            model = joblib.load(grammar_model_path)
+            vectorizer = joblib.load(vectorizer_path)
             return model, vectorizer
         else:
             return None, None
@@ -44,6 +85,127 @@ def load_models():
         print(f"載入模型時發生錯誤: {str(e)}")
         return None, None
 
+def save_model_file(obj, path):
+    """以 joblib 儲存，先寫入暫存檔再替換，讀取端不會讀到寫到一半的檔案"""
+    tmp_path = f"{path}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class ModelHolder:
+    """
+    行程層級的模型持有者：只載入一次，模型檔的修改時間或大小改變時才檢查內容雜湊，
+    內容確實不同才重新載入；也可以由 /api/reload_model 強制重新載入
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self._lock = threading.Lock()
+        # (model, vectorizer) 以單一參考替換，請求取得的一定是成對的模型
+        self._models = (None, None)
+        self._signatures = None
+        self._hashes = None
+        self.loaded_at = None
+
+    def _current_signatures(self):
+        return tuple(_file_signature(path) for path in self.paths)
+
+    def get(self):
+        """返回 (model, vectorizer)；模型檔不存在時返回 (None, None)"""
+        if self._current_signatures() != self._signatures:
+            self.reload()
+        return self._models
+
+    def reload(self, force=False):
+        with self._lock:
+            signatures = self._current_signatures()
+            if not force and signatures == self._signatures:
+                return self._models
+
+            if None in signatures:
+                self._models = (None, None)
+                self._signatures = signatures
+                self._hashes = None
+                return self._models
+
+            hashes = tuple(file_sha256(path) for path in self.paths)
+            if force or hashes != self._hashes or self._models[0] is None:
+                model, vectorizer = load_models()
+                if model is None:
+                    # 載入失敗時保留原本的模型，下一個請求再重試
+                    return self._models
+                if getattr(model, 'training_id_', None) != getattr(vectorizer, 'training_id_', None):
+                    # 兩個檔案來自不同次訓練（新模型替換到一半），保留原本的模型，下一個請求再檢查
+                    return self._models
+                # 服務端預測使用目前設定的 worker 數（不沿用訓練時的設定）
+                apply_n_jobs(model, 'predict')
+                self._models = (model, vectorizer)
+                self._hashes = hashes
+                self.loaded_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._signatures = signatures
+            return self._models
+
+    def info(self):
+        return {
+            'loaded': self._models[0] is not None,
+            'loaded_at': self.loaded_at,
+            'hashes': list(self._hashes) if self._hashes else None
+        }
+
+model_holder = ModelHolder((grammar_model_path, vectorizer_path))
+
+def build_issue_engine(rules_path):
+    """將內建樣式與規則檔中的規則（有建議寫法者）依問題類型合併，編譯成單一比對引擎"""
+    rules = {}
+    seen = set()
+
+    def add(issue_type, original, corrected):
+        if corrected and (issue_type, original.lower()) not in seen:
+            seen.add((issue_type, original.lower()))
+            rules.setdefault(issue_type, []).append({'original': original, 'corrected': [corrected]})
+
+    for issue_type, patterns in DEFAULT_ISSUE_PATTERNS.items():
+        for original, corrected in patterns:
+            add(issue_type, original, corrected)
+
+    if os.path.exists(rules_path):
+        try:
+            for issue_type, original, corrected in load_rule_engine(rules_path).rule_meta:
+                add(issue_type, original, corrected)
+        except Exception as e:
+            print(f"載入文法規則檔時發生錯誤: {str(e)}")
+
+    return CompiledRuleEngine(rules)
+
+class IssuePatternRegistry:
+    """
+    detect_issues 使用的樣式表：啟動時編譯一次，規則檔更新後才重新編譯
+    所有問題類型共用一個引擎，掃描文章一次即可得到每個預測類別的結果
+    """
+
+    def __init__(self, rules_path):
+        self.rules_path = rules_path
+        self._lock = threading.Lock()
+        self._signature = _file_signature(rules_path)
+        self._engine = build_issue_engine(rules_path)
+
+    def get(self):
+        signature = _file_signature(self.rules_path)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._engine = build_issue_engine(self.rules_path)
+                    self._signature = signature
+        return self._engine
+
+issue_registry = IssuePatternRegistry(grammar_rules_path)
+
 # 預處理文本
 def preprocess_text(text):
     # 轉小寫
@@ -77,8 +239,8 @@ def analyze_grammar():
     text = data['text']
     category = data.get('category', 'general')
     
-    # 載入模型
-    model, vectorizer = load_models()
+    # 取得已載入的模型（模型檔有更新時才會重新載入）
+    model, vectorizer = model_holder.get()
     
     # 如果模型不存在，返回空結果
     if model is None or vectorizer is None:
@@ -95,24 +257,8 @@ def analyze_grammar():
     try:
         # 簡單示範：預測文法問題類型
         # 實際情況下，可能需要更複雜的邏輯
-        predictions = model.predict(features)
         prediction_proba = model.predict_proba(features)
-        
-        # 解析預測結果
-        grammar_issues = {}
-        for i, issue_type in enumerate(model.classes_):
-            if prediction_proba[0][i] > 0.3:  # 機率閾值
-                grammar_issues[issue_type] = detect_issues(text, issue_type)
-        
-        # 計算分數 (根據文法問題數量)
-        issue_count = sum(len(issues) for issues in grammar_issues.values())
-        score = max(60, 95 - (issue_count * 2))
-        
-        return jsonify({
-            'grammar_issues': grammar_issues,
-            'score': score,
-            'model_version': '1.0'
-        })
+        return jsonify(build_grammar_result(text, prediction_proba[0], model.classes_))
     except Exception as e:
         print(f"預測時發生錯誤: {str(e)}")
         return jsonify({
@@ -122,38 +268,108 @@ def analyze_grammar():
             'error': str(e)
         })
 
+# 依預測機率整理單篇文章的文法問題與分數
+def build_grammar_result(text, probabilities, classes):
+    # 解析預測結果
+    predicted_types = [issue_type for i, issue_type in enumerate(classes)
+                       if probabilities[i] > 0.3]  # 機率閾值
+    
+    # 掃描一次文章即可得到所有預測類別的問題
+    matches = find_issue_matches(text, predicted_types)
+    grammar_issues = {}
+    issue_spans = {}
+    for issue_type in predicted_types:
+        grammar_issues[issue_type] = issue_messages(matches.get(issue_type, []))
+        issue_spans[issue_type] = matches.get(issue_type, [])
+    
+    # 計算分數 (根據文法問題數量)
+    issue_count = sum(len(issues) for issues in grammar_issues.values())
+    score = max(60, 95 - (issue_count * 2))
+    
+    return {
+        'grammar_issues': grammar_issues,
+        'issue_spans': issue_spans,
+        'score': score,
+        'model_version': '1.0'
+    }
+
+# 批次文法分析 API 端點：一次向量化與預測整批文章，結果依輸入順序返回
+@app.route('/api/analyze_grammar_batch', methods=['POST'])
+def analyze_grammar_batch():
+    data = request.json
+    if not data or not isinstance(data.get('texts'), list):
+        return jsonify({'error': 'No texts provided'}), 400
+    
+    # 每個項目可以是文字，或是 {"text": ..., "category": ...}
+    texts = []
+    for item in data['texts']:
+        text = item.get('text') if isinstance(item, dict) else item
+        if not isinstance(text, str):
+            return jsonify({'error': 'Each item must be a text or contain a text field'}), 400
+        texts.append(text)
+    
+    model, vectorizer = model_holder.get()
+    
+    if model is None or vectorizer is None:
+        default = {
+            'grammar_issues': {},
+            'score': 85,
+            'model_version': 'default'
+        }
+        return jsonify({'results': [dict(default) for _ in texts]})
+    
+    if not texts:
+        return jsonify({'results': []})
+    
+    try:
+        # 整批只做一次 transform 與 predict_proba
+        features = vectorizer.transform([preprocess_text(text) for text in texts])
+        prediction_proba = model.predict_proba(features)
+        results = [build_grammar_result(text, probabilities, model.classes_)
+                   for text, probabilities in zip(texts, prediction_proba)]
+        return jsonify({'results': results})
+    except Exception as e:
+        print(f"批次預測時發生錯誤: {str(e)}")
+        return jsonify({
+            'results': [{
+                'grammar_issues': {},
+                'score': 85,
+                'model_version': 'default',
+                'error': str(e)
+            } for _ in texts]
+        })
+
+# 找出文章中屬於指定問題類型的所有錯誤位置（issue_types 為 None 時不限類型）
+def find_issue_matches(text, issue_types=None):
+    engine = issue_registry.get()
+    wanted = None if issue_types is None else set(issue_types)
+    
+    matches = {}
+    for start, end, rule_id in engine.match_spans(text, flexible_whitespace=False):
+        issue_type, original, corrected = engine.rule_meta[rule_id]
+        if wanted is not None and issue_type not in wanted:
+            continue
+        matches.setdefault(issue_type, []).append({
+            'start': start,
+            'end': end,
+            'text': text[start:end],
+            'original': original,
+            'correction': corrected,
+            'rule_id': rule_id
+        })
+    return matches
+
+# 每個命中的樣式產生一則說明，依樣式在樣式表中的順序排列
+def issue_messages(matches):
+    first_matches = {}
+    for match in matches:
+        first_matches.setdefault(match['rule_id'], match)
+    return [f"'{match['original']}' 應為 '{match['correction']}'"
+            for _, match in sorted(first_matches.items())]
+
 # 根據問題類型檢測特定問題
 def detect_issues(text, issue_type):
-    issues = []
-    
-    # 這裡應該實現根據不同問題類型的檢測邏輯
-    # 以下是一個簡單的示範
-    if issue_type == 'subject_verb_agreement':
-        # 檢查主謂一致性問題的簡單規則
-        patterns = [
-            (r'\bthey is\b', 'they are'),
-            (r'\bhe are\b', 'he is'),
-            (r'\bshe are\b', 'she is'),
-            (r'\bit are\b', 'it is')
-        ]
-        for pattern, correction in patterns:
-            if re.search(pattern, text.lower()):
-                issues.append(f"'{pattern[2:-2]}' 應為 '{correction}'")
-    
-    elif issue_type == 'tense':
-        # 檢查時態問題
-        patterns = [
-            (r'\bhave went\b', 'have gone'),
-            (r'\bhas went\b', 'has gone'),
-            (r'\bwill went\b', 'will go')
-        ]
-        for pattern, correction in patterns:
-            if re.search(pattern, text.lower()):
-                issues.append(f"'{pattern[2:-2]}' 應為 '{correction}'")
-    
-    # 可以添加更多問題類型的檢測邏輯
-    
-    return issues
+    return issue_messages(find_issue_matches(text, [issue_type]).get(issue_type, []))
 
 # 接收教師反饋以進行訓練
 @app.route('/api/submit_feedback', methods=['POST'])
@@ -164,39 +380,20 @@ def submit_feedback():
         return jsonify({'error': 'Missing required fields'}), 400
     
     # 儲存反饋資料以供後續訓練
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    feedback_file = os.path.join(training_data_path, f'feedback_{timestamp}.json')
+    record = feedback_store.append(data)
     
-    with open(feedback_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({'success': True, 'message': 'Feedback received for training'})
+    return jsonify({'success': True, 'message': 'Feedback received for training', 'feedback_id': record['id']})
 
-# 訓練模型 API
-@app.route('/api/train_model', methods=['POST'])
-def train_model():
-    # 獲取所有反饋資料
-    feedback_files = [os.path.join(training_data_path, f) for f in os.listdir(training_data_path) 
-                     if f.startswith('feedback_') and f.endswith('.json')]
-    
-    if not feedback_files:
-        return jsonify({'success': False, 'message': 'No feedback data available for training'})
-    
-    # 載入反饋資料
-    training_data = []
-    for file in feedback_files:
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                feedback = json.load(f)
-                training_data.append(feedback)
-        except Exception as e:
-            print(f"讀取反饋檔案時發生錯誤: {str(e)}")
-    
-    # 解析反饋數據進行訓練
+# 從游標之後的反饋紀錄整理訓練資料，返回 (文本, 標籤, 反饋筆數, 讀取後的游標)
+def collect_training_examples(cursor=None):
+    feedback_count = 0
     X = []  # 文本特徵
     y = []  # 問題類型標籤
     
-    for feedback in training_data:
+    # 依序串流讀取反饋紀錄
+    for cursor, record in feedback_store.iter_records(cursor):
+        feedback = record.get('data') or {}
+        feedback_count += 1
         essay_text = feedback.get('essay_text', '')
         
         for issue in feedback.get('feedback', []):
@@ -210,40 +407,226 @@ def train_model():
                     X.append(context)
                     y.append(issue_type)
     
-    if not X or not y:
-        return jsonify({'success': False, 'message': 'No valid training examples found'})
-    
+    return X, y, feedback_count, cursor
+
+# 以同一個訓練 id 儲存模型與向量化器並載入；ModelHolder 只會載入 id 相同的一對
+def promote_models(model, vectorizer, training_id):
+    model.training_id_ = training_id
+    vectorizer.training_id_ = training_id
+    save_model_file(vectorizer, vectorizer_path)
+    save_model_file(model, grammar_model_path)
+    model_holder.reload()
+
+# 讀取上次訓練的資訊（檢查點）
+def load_training_info():
+    try:
+        with open(training_info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# 儲存訓練資訊（先寫暫存檔再替換）
+def save_training_info(training_info):
+    tmp_path = f"{training_info_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(training_info, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, training_info_path)
+
+# 線上模型：無狀態的雜湊向量化器（不需要重新擬合）與支援 partial_fit、predict_proba 的線性分類器
+def create_online_models():
+    vectorizer = HashingVectorizer(n_features=2 ** 18, alternate_sign=False)
+    model = SGDClassifier(loss='log_loss', alpha=1e-5, random_state=42, n_jobs=get_n_jobs('fit'))
+    return model, vectorizer
+
+# 判斷能否以增量方式更新目前的模型；不能時返回原因
+def incremental_blocker(checkpoint, model, vectorizer, labels):
+    if checkpoint.get('mode') not in ('incremental', 'full') or not checkpoint.get('feedback_cursor'):
+        return 'no online checkpoint'
+    if not isinstance(model, SGDClassifier) or not isinstance(vectorizer, HashingVectorizer):
+        return 'current model is not an online model'
+    if checkpoint.get('updates_since_refit', 0) >= FULL_REFIT_EVERY:
+        return f'{FULL_REFIT_EVERY} incremental updates since last full refit'
+    new_labels = set(labels) - set(model.classes_)
+    if new_labels:
+        return f'new issue types: {sorted(new_labels)}'
+    return None
+
+# 原本的完整重訓：TF-IDF + 隨機森林
+def fit_forest(job, X, y):
     # 訓練向量化器
+    job.update(phase='vectorizing')
     vectorizer = TfidfVectorizer(max_features=5000)
     X_features = vectorizer.fit_transform(X)
     
     # 訓練模型 (使用隨機森林分類器作為示範)
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    # 範例足夠時以袋外樣本 (OOB) 估計準確率，不必另外切分驗證集
+    job.update(phase='fitting')
+    use_oob = len(X) >= 20 and len(set(y)) > 1
+    model = RandomForestClassifier(n_estimators=100, random_state=42, oob_score=use_oob, n_jobs=get_n_jobs('fit'))
     model.fit(X_features, y)
     
-    # 儲存模型
-    with open(grammar_model_path, 'wb') as f:
-        pickle.dump(model, f)
+    job.update(phase='evaluating')
+    apply_n_jobs(model, 'predict')
+    metrics = {'train_accuracy': round(float(model.score(X_features, y)), 4)}
+    if use_oob:
+        metrics['oob_accuracy'] = round(float(model.oob_score_), 4)
+    return model, vectorizer, metrics
+
+# 以全部反饋重訓線上模型
+def fit_online(job, X, y):
+    if len(set(y)) < 2:
+        raise ValueError('At least two issue types are required to train the online model')
+    
+    model, vectorizer = create_online_models()
+    job.update(phase='vectorizing')
+    X_features = vectorizer.transform(X)
+    
+    job.update(phase='fitting')
+    model.fit(X_features, y)
+    
+    job.update(phase='evaluating')
+    apply_n_jobs(model, 'predict')
+    return model, vectorizer, {'train_accuracy': round(float(model.score(X_features, y)), 4)}
+
+# 以新反饋增量更新線上模型（在從檔案重新載入的副本上更新，不影響服務中的模型）
+def update_online(job, X, y):
+    model = joblib.load(grammar_model_path)
+    vectorizer = joblib.load(vectorizer_path)
     
-    with open(vectorizer_path, 'wb') as f:
-        pickle.dump(vectorizer, f)
+    job.update(phase='vectorizing')
+    X_features = vectorizer.transform(X)
     
-    # 儲存訓練資訊
+    # 先以更新前的模型預測新資料（prequential 準確率），再用同一批資料更新
+    job.update(phase='evaluating')
+    metrics = {'prequential_accuracy': round(float(model.score(X_features, y)), 4)}
+    
+    job.update(phase='fitting')
+    apply_n_jobs(model, 'fit')
+    model.partial_fit(X_features, y)
+    apply_n_jobs(model, 'predict')
+    return model, vectorizer, metrics
+
+# 背景訓練工作：job.update 回報進度，完成後才替換服務中的模型
+def run_training(job, mode=DEFAULT_TRAINING_MODE):
+    checkpoint = load_training_info()
+    
+    # 增量模式只讀取檢查點之後的反饋
+    cursor = None
+    if mode == 'incremental':
+        cursor = checkpoint.get('feedback_cursor')
+        current_model, current_vectorizer = model_holder.get()
+        if current_model is None:
+            cursor = None
+    
+    job.update(phase='loading_feedback', mode=mode)
+    X, y, feedback_count, end_cursor = collect_training_examples(cursor)
+    job.update(examples=len(X), feedback_records=feedback_count)
+    
+    if mode == 'incremental' and cursor:
+        if not X:
+            if end_cursor != cursor:
+                # 新反饋中沒有可用的範例，只推進檢查點
+                checkpoint['feedback_cursor'] = end_cursor
+                save_training_info(checkpoint)
+            return {'message': 'No new feedback since last checkpoint', 'training_info': checkpoint}
+        
+        reason = incremental_blocker(checkpoint, current_model, current_vectorizer, y)
+        if reason:
+            # 無法增量更新時改為以全部反饋完整重訓
+            job.update(refit_reason=reason)
+            mode = 'full'
+            X, y, feedback_count, end_cursor = collect_training_examples()
+            job.update(mode=mode, examples=len(X), feedback_records=feedback_count)
+    elif mode == 'incremental':
+        job.update(refit_reason='no online checkpoint')
+        mode = 'full'
+        job.update(mode=mode)
+    
+    if not feedback_count:
+        raise ValueError('No feedback data available for training')
+    if not X or not y:
+        raise ValueError('No valid training examples found')
+    
+    if mode == 'full' and len(set(y)) < 2:
+        # 線上模型至少需要兩種問題類型，只有一種時改用隨機森林
+        job.update(refit_reason='single issue type', mode='forest')
+        mode = 'forest'
+    
+    if mode == 'forest':
+        model, vectorizer, metrics = fit_forest(job, X, y)
+    elif mode == 'full':
+        model, vectorizer, metrics = fit_online(job, X, y)
+    else:
+        model, vectorizer, metrics = update_online(job, X, y)
+    
+    metrics['class_counts'] = {label: y.count(label) for label in sorted(set(y))}
+    job.update(metrics=metrics)
+    
+    # 儲存並替換模型
+    job.update(phase='promoting')
+    promote_models(model, vectorizer, job.id)
+    
+    # 儲存訓練資訊（同時作為下一次增量訓練的檢查點）
+    previous_examples = checkpoint.get('num_examples', 0) if mode == 'incremental' else 0
     training_info = {
         'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'num_examples': len(X),
-        'classes': list(set(y)),
-        'model_version': '1.0.1'
+        'num_examples': previous_examples + len(X),
+        'classes': [str(label) for label in model.classes_],
+        'model_version': '1.0.1',
+        'job_id': job.id,
+        'mode': mode,
+        'feedback_cursor': end_cursor,
+        'updates_since_refit': checkpoint.get('updates_since_refit', 0) + 1 if mode == 'incremental' else 0,
+        'metrics': metrics
     }
+    save_training_info(training_info)
     
-    info_path = os.path.join(model_path, 'training_info.json')
-    with open(info_path, 'w', encoding='utf-8') as f:
-        json.dump(training_info, f, ensure_ascii=False, indent=2)
+    return {
+        'message': f'Model trained ({mode}) with {len(X)} examples',
+        'training_info': training_info
+    }
+
+# 訓練模型 API：啟動背景訓練並立即返回工作 id
+@app.route('/api/train_model', methods=['POST'])
+def train_model():
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', DEFAULT_TRAINING_MODE)
+    if mode not in TRAINING_MODES:
+        return jsonify({'success': False, 'message': f'Unknown training mode: {mode}'}), 400
+    
+    try:
+        job_id = training_runner.submit(lambda job: run_training(job, mode))
+    except TrainingBusyError as e:
+        return jsonify({
+            'success': False,
+            'message': 'A training job is already running',
+            'job_id': e.job_id
+        }), 409
     
     return jsonify({
-        'success': True, 
-        'message': f'Model trained with {len(X)} examples',
-        'training_info': training_info
+        'success': True,
+        'message': f'Training job {job_id} started',
+        'job_id': job_id,
+        'mode': mode,
+        'status_url': f'/api/train_model/{job_id}'
+    }), 202
+
+# 訓練工作狀態 API：階段、範例數、經過時間與評估指標（未指定 id 時為最近一次）
+@app.route('/api/train_model', methods=['GET'])
+@app.route('/api/train_model/<job_id>', methods=['GET'])
+def training_status(job_id=None):
+    status = training_runner.get(job_id) if job_id else training_runner.latest()
+    if status is None:
+        return jsonify({'success': False, 'message': 'Training job not found'}), 404
+    return jsonify(status)
+
+# 重新載入模型 API
+@app.route('/api/reload_model', methods=['POST'])
+def reload_model():
+    model, vectorizer = model_holder.reload(force=True)
+    return jsonify({
+        'success': model is not None,
+        'model': model_holder.info()
     })
 
 # 從文章中提取包含錯誤表達的上下文
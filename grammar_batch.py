@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+文法檢測批次模式 - 一個行程處理整批作文，每完成一篇就輸出一行 JSON
+
+輸入來源可以是：
+- 目錄：目錄下的每個檔案為一篇作文（依檔名排序，id 為檔名）
+- glob 樣式：例如 essays/*.txt（id 為檔案路徑）
+- "-"：從 stdin 讀取 JSONL，每行為 {"id": ..., "text": ...} 或 {"id": ..., "file": ...}，
+  其餘欄位（如 score、category）會原樣交給處理函數
+
+輸入以產生器逐篇讀取、結果逐行寫出，記憶體用量與作文總數無關。
+處理過程中的除錯訊息會改寫到 stderr，stdout 只包含 JSONL 結果。
+"""
+
+import collections
+import contextlib
+import functools
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _read_text_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def iter_batch_inputs(source, stdin=None):
+    """
+    逐篇產生 (essay_id, record)；record 至少包含 'text'，無法讀取時改為包含 'error'
+    """
+    if source == '-':
+        stream = stdin or sys.stdin
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if isinstance(record, str):
+                    record = {'text': record}
+                essay_id = record.get('id', line_number)
+                if 'text' not in record and record.get('file'):
+                    record['text'] = _read_text_file(record['file'])
+                if not isinstance(record.get('text'), str):
+                    raise ValueError("missing 'text'")
+            except (ValueError, OSError, AttributeError) as e:
+                yield line_number, {'error': f"無法解析第 {line_number} 行: {e}"}
+                continue
+            yield essay_id, record
+        return
+
+    if os.path.isdir(source):
+        paths = (os.path.join(source, name) for name in sorted(os.listdir(source)))
+        paths = (path for path in paths if os.path.isfile(path))
+        use_name = True
+    else:
+        paths = (path for path in sorted(glob.glob(source)) if os.path.isfile(path))
+        use_name = False
+
+    for path in paths:
+        essay_id = os.path.basename(path) if use_name else path
+        try:
+            yield essay_id, {'text': _read_text_file(path)}
+        except (OSError, UnicodeDecodeError) as e:
+            yield essay_id, {'error': f"讀取文本文件失敗: {e}"}
+
+
+def _process_record(process, record):
+    """處理單篇作文；除錯訊息改寫到 stderr，例外轉成錯誤結果"""
+    if 'error' in record:
+        return {'success': False, 'error': record['error']}
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            return process(record['text'], record)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def _process_item(process, item):
+    return _process_record(process, item[1])
+
+
+def process_batch(items, process):
+    """
+    依序處理每篇作文，單篇失敗不會中斷整批；產生 (essay_id, result)
+
+    process(text, record) 返回該篇的結果字典。
+    """
+    for essay_id, record in items:
+        yield essay_id, _process_record(process, record)
+
+
+def parallel_map(func, items, workers, initializer=None, initargs=(), window=None):
+    """
+    以行程池執行 func(item)，依輸入順序產生 (item, result 或 exception)
+
+    同時送出的工作數量限制在 window（預設為 workers 的 4 倍），
+    因此輸入可以是無限長的串流，記憶體用量不會隨輸入增加。
+    單一工作失敗（包括工作行程異常結束）只會影響該筆結果。
+    """
+    window = window or workers * 4
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= window:
+                yield _collect(*pending.popleft())
+        while pending:
+            yield _collect(*pending.popleft())
+
+
+def _collect(item, future):
+    try:
+        return item, future.result()
+    except Exception as e:
+        return item, e
+
+
+def process_batch_parallel(items, process, workers, initializer=None, initargs=()):
+    """
+    process_batch 的多行程版本，結果依輸入順序產生
+
+    process 必須是模組層級的函數（會被傳送到工作行程）；
+    規則等共用狀態應由 initializer 在每個工作行程中載入一次。
+    """
+    task = functools.partial(_process_item, process)
+    for (essay_id, record), result in parallel_map(task, items, workers, initializer, initargs):
+        if isinstance(result, Exception):
+            result = {'success': False, 'error': str(result)}
+        yield essay_id, result
+
+
+def write_batch_results(results, out=None):
+    """每完成一篇就寫出一行 JSON 並立即 flush；返回處理篇數與失敗篇數"""
+    out = out or sys.stdout
+    total = 0
+    failed = 0
+    for essay_id, result in results:
+        total += 1
+        if result.get('success') is False:
+            failed += 1
+        line = {'id': essay_id}
+        line.update(result)
+        out.write(json.dumps(line, ensure_ascii=False) + '\n')
+        out.flush()
+    return total, failed
+
+
+def run_batch(source, process, out=None, workers=1, initializer=None, initargs=()):
+    """
+    讀取輸入來源、逐篇處理並輸出 JSONL
+
+    workers 大於 1 時以行程池平行處理（process 與 initializer 的限制見 process_batch_parallel）。
+    """
+    items = iter_batch_inputs(source)
+    if workers and workers > 1:
+        results = process_batch_parallel(items, process, workers, initializer, initargs)
+    else:
+        results = process_batch(items, process)
+    total, failed = write_batch_results(results, out)
+    print(f"批次處理完成: {total} 篇，失敗 {failed} 篇", file=sys.stderr)
+    return failed
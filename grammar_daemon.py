@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+常駐文法檢測服務 - 讓 score_essay.py / enhanced_feedback.py 不必每篇作文都重新啟動
+
+PHP 每批改一篇作文就會啟動一次 Python、重新 import 模組並重新載入規則。
+以 `python score_essay.py --serve` 或 `python enhanced_feedback.py --serve` 啟動常駐服務後，
+規則與編譯後的比對表會一直保留在記憶體中（規則檔變更時自動重新載入），
+命令列工具則先嘗試把請求轉送給本服務，服務未啟動時才回到原本的行程內執行。
+
+服務只監聽本機 HTTP（部署環境為 Windows/XAMPP，無法使用 Unix socket）：
+
+    POST /score_essay         {"text": ..., "rules": 規則檔路徑或 null}
+    POST /enhanced_feedback   {"text": ..., "rules": ..., "score": ..., "category": ..., "feedback": true/false}
+    GET  /health
+
+回應內容與對應命令列工具輸出的 JSON 相同。
+
+可使用的規則檔在啟動時就決定（--rules 指定的檔案與各腳本的預設路徑），
+請求中的 "rules" 必須是其中之一，否則返回 403，命令列工具會改回行程內執行；
+服務不會解開客戶端指定的任意檔案。
+"""
+
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from grammar_rule_engine import RuleEngineCache
+
+# 預設監聽位址，可用環境變數覆寫
+DEFAULT_HOST = os.environ.get('GRAMMAR_DAEMON_HOST', '127.0.0.1')
+DEFAULT_PORT = int(os.environ.get('GRAMMAR_DAEMON_PORT', '5050'))
+
+# 連線逾時很短：服務沒有啟動時應立即回到行程內執行
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 60
+
+
+def _rules_paths(rules_path, default_paths):
+    """指定的規則檔優先，其次為各腳本的預設路徑（皆轉為絕對路徑）"""
+    paths = ([rules_path] if rules_path else []) + list(default_paths)
+    return [os.path.abspath(path) for path in paths]
+
+
+class RulesNotAllowedError(Exception):
+    """請求指定了服務啟動時未允許的規則檔"""
+
+
+class GrammarService:
+    """常駐服務的處理邏輯，與 HTTP 層分開以便在其他地方重複使用"""
+
+    def __init__(self, rules_path=None):
+        # 延遲 import，避免與 score_essay / enhanced_feedback 互相 import
+        import score_essay
+        import enhanced_feedback
+
+        self.score_essay = score_essay
+        self.enhanced_feedback = enhanced_feedback
+        # 各端點的候選規則檔在啟動時固定，之後不會改變
+        self.rules_paths = {
+            'score_essay': _rules_paths(rules_path, score_essay.DEFAULT_RULES_PATHS),
+            'enhanced_feedback': _rules_paths(rules_path, enhanced_feedback.DEFAULT_RULES_PATHS)
+        }
+        self.engines = RuleEngineCache()
+        self.started_at = time.time()
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    def _engine(self, endpoint, requested=None):
+        """
+        端點使用的引擎；requested 只能是啟動時允許的規則檔之一，並優先使用
+        指定的規則檔載入失敗時依序改用其他候選路徑
+        """
+        paths = self.rules_paths[endpoint]
+        if requested:
+            requested = os.path.abspath(requested)
+            if requested not in paths:
+                raise RulesNotAllowedError(f"Rules file not allowed: {requested}")
+            paths = [requested] + [path for path in paths if path != requested]
+        return self.engines.get(paths)
+
+    def preload(self):
+        """先載入各端點使用的規則，第一個請求就不必等待"""
+        for endpoint in self.rules_paths:
+            self._engine(endpoint)
+
+    def handle_score_essay(self, payload):
+        """與 score_essay.py 命令列輸出相同的結果"""
+        engine = self._engine('score_essay', payload.get('rules'))
+        issues = self.score_essay.check_grammar_issues(payload.get('text', ''), engine)
+        return {
+            'success': True,
+            'issues': issues
+        }
+
+    def handle_enhanced_feedback(self, payload):
+        """與 enhanced_feedback.py 命令列輸出相同的結果"""
+        engine = self._engine('enhanced_feedback', payload.get('rules'))
+        analysis = self.enhanced_feedback.analyze_text(payload.get('text', ''), grammar_rules=engine)
+        if payload.get('feedback'):
+            analysis["feedback"] = self.enhanced_feedback.generate_feedback(
+                analysis, payload.get('score'), payload.get('category'))
+        return analysis
+
+    def handle(self, endpoint, payload):
+        """依端點分派請求"""
+        with self._lock:
+            self.request_count += 1
+
+        if endpoint == 'score_essay':
+            return self.handle_score_essay(payload)
+        if endpoint == 'enhanced_feedback':
+            return self.handle_enhanced_feedback(payload)
+        raise KeyError(endpoint)
+
+    def health(self):
+        return {
+            'status': 'healthy',
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started_at, 1),
+            'requests': self.request_count
+        }
+
+
+def _make_handler(service):
+    class GrammarRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, service.health())
+            else:
+                self._send_json(404, {'success': False, 'error': 'Not found'})
+
+        def do_POST(self):
+            endpoint = self.path.strip('/')
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+                self._send_json(200, service.handle(endpoint, payload))
+            except KeyError:
+                self._send_json(404, {'success': False, 'error': f'Unknown endpoint: {endpoint}'})
+            except RulesNotAllowedError as e:
+                self._send_json(403, {'success': False, 'error': str(e)})
+            except Exception as e:
+                print(f"處理請求 {endpoint} 時發生錯誤: {e}", file=sys.stderr)
+                self._send_json(500, {'success': False, 'error': str(e)})
+
+        def log_message(self, format, *args):
+            # 每個請求的存取紀錄寫到 stderr，避免干擾 stdout
+            sys.stderr.write("%s - %s\n" % (self.address_string(), format % args))
+
+    return GrammarRequestHandler
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, rules_path=None):
+    """啟動常駐服務（阻塞直到中斷）"""
+    service = GrammarService(rules_path)
+    service.preload()
+
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    print(f"文法檢測服務已啟動: http://{host}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request_daemon(endpoint, payload, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    將請求轉送給常駐服務並返回解析後的 JSON
+
+    服務未啟動、逾時或回應錯誤時返回 None，呼叫端應改為在行程內執行。
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=CONNECT_TIMEOUT)
+    try:
+        conn.connect()
+        conn.sock.settimeout(REQUEST_TIMEOUT)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        conn.request('POST', f'/{endpoint}', body, {'Content-Type': 'application/json; charset=utf-8'})
+        response = conn.getresponse()
+        if response.status != 200:
+            return None
+        return json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
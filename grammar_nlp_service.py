@@ -10,6 +10,7 @@ import spacy
 import torch
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from flask import Flask, request, jsonify
+from gec_inference import SentenceCache, correct_text, model_identity
 
 app = Flask(__name__)
 
@@ -17,6 +18,10 @@ app = Flask(__name__)
 model_name = "facebook/bart-large-cnn"  # 可替換為GEC特定的模型
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+model_id = model_identity(model_name)
+
+# 句子糾正結果快取：重新提交的草稿只有改過的句子需要再送進模型
+sentence_cache = SentenceCache()
 
 # 載入spaCy用於語法分析
 nlp = spacy.load("en_core_web_lg")
@@ -29,17 +34,24 @@ def analyze_grammar():
     # 使用spaCy進行基本語法分析
     doc = nlp(text)
     
-    # 使用Transformer模型進行語法糾正
-    inputs = tokenizer(text, return_tensors="pt", max_length=512, truncation=True)
-    outputs = model.generate(inputs.input_ids, max_length=512)
-    corrected_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    # 使用Transformer模型逐句進行語法糾正（依句長分批，長文不會被截斷）
+    corrected_text, sentences = correct_text(text, doc, tokenizer, model, cache=sentence_cache, model_id=model_id)
     
     # 分析找出的錯誤
     grammar_issues = find_grammar_issues(text, corrected_text, doc)
     
     return jsonify({
         'corrected_text': corrected_text,
-        'grammar_issues': grammar_issues
+        'grammar_issues': grammar_issues,
+        'sentences': sentences
+    })
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify({
+        'status': 'healthy',
+        'model': model_name,
+        'cache': sentence_cache.stats()
     })
 
 @app.route('/finetune', methods=['POST'])
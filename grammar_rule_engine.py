@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+文法規則比對引擎 - 將 grammar_rules.pkl 的規則一次編譯成單詞前綴樹
+
+原本的 check_grammar_issues 會為每一條規則組出正則表達式並對整篇文章執行
+re.findall，成本與「規則數 × 文章長度」成正比。這裡改為：
+
+1. 載入規則時，把由單詞與單一空格組成的 original（絕大多數規則）依小寫單詞
+   建成前綴樹 (trie)，其餘格式特殊的規則才預先編譯成個別的正則表達式。
+2. 檢查文章時只掃描一次文章中的單詞，每個位置沿前綴樹往下走，
+   因此耗時取決於文章長度，與規則數量無關。
+
+比對語意與原本的 r'(?i)\b' + re.escape(original) + r'\b' 完全相同：
+單詞必須是完整的 \w+ 片段，短語中的單詞之間在寬鬆模式下可為任意空白 (\s+)，
+在嚴格模式下必須剛好是一個空格。
+
+編譯結果會寫入與 pickle 同目錄的索引檔 (grammar_rules.idx)，之後的執行以 marshal 讀回
+比對表，省下的只是解開 pickle 之後重新編譯前綴樹的時間：讀取索引仍會還原整個比對表，
+耗時與規則數成正比，也比單純 pickle.load 規則檔慢（3 萬條規則時索引約 0.09 秒，
+pickle.load 加上編譯約 0.15 秒）。索引記錄來源檔的 SHA-256 與
+marshal 格式版本，來源變更或 Python 版本不同時自動重建。
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import pickle
+import re
+import struct
+import sys
+import tempfile
+import threading
+
+# 文章中的單詞 (與 \b 的定義一致)
+WORD_RE = re.compile(r'\w+')
+
+# 可以放進前綴樹的規則：單詞之間以單一空格分隔
+TRIE_RULE_RE = re.compile(r'\w+(?: \w+)*')
+
+# 索引檔格式：魔術字 + 格式版本 + 標頭長度 + JSON 標頭 + marshal 編碼的比對表
+INDEX_MAGIC = b'GRIX'
+INDEX_VERSION = 1
+INDEX_PREFIX = struct.Struct('<4sII')
+INDEX_SUFFIX = '.idx'
+
+
+def build_rule_pattern(original, flexible_whitespace=True):
+    """建立單一規則的正則表達式（與原本逐條比對時的寫法相同）"""
+    if flexible_whitespace and ' ' in original:
+        # 允許短語中間有變化的字詞間距
+        return r'(?i)\b' + re.escape(original).replace(r'\ ', r'\s+') + r'\b'
+    return r'(?i)\b' + re.escape(original) + r'\b'
+
+
+def format_suggestion(original, corrected):
+    """產生與原本相同格式的建議字串"""
+    return f"'{original}' 可能應為 '{corrected}'"
+
+
+class CompiledRuleEngine:
+    """由 rules 字典編譯出的多規則比對器，可重複用於任意數量的文章"""
+
+    def __init__(self, rules=None, descriptions=None):
+        # 錯誤類型描述（來自規則檔，可能為 None）
+        self.descriptions = descriptions
+        # 每條規則的中繼資料：(錯誤類型, original, corrected 第一個值或 None)
+        # 規則編號依「錯誤類型順序、類型內規則順序」遞增，排序後即為原本的輸出順序
+        self.rule_meta = []
+        # 各錯誤類型的規則數（用於輸出載入資訊）
+        self.type_counts = []
+        # 前綴樹：{單詞: [規則編號列表, 子節點字典]}
+        self.trie = {}
+        # 無法放進前綴樹的規則編號
+        self.fallback_ids = []
+        # 依比對模式快取的 fallback 正則表達式
+        self._fallback_patterns = {}
+
+        for error_type, type_rules in (rules or {}).items():
+            self.type_counts.append((error_type, len(type_rules)))
+            for rule in type_rules:
+                if not isinstance(rule, dict) or not isinstance(rule.get('original'), str):
+                    continue
+
+                original = rule['original']
+                corrected = rule['corrected'][0] if rule.get('corrected') else None
+                rule_id = len(self.rule_meta)
+                self.rule_meta.append((error_type, original, corrected))
+
+                if TRIE_RULE_RE.fullmatch(original):
+                    self._insert(original.lower().split(' '), rule_id)
+                else:
+                    self.fallback_ids.append(rule_id)
+
+    def __len__(self):
+        """錯誤類型數，與原本 len(rules) 的意義相同"""
+        return len(self.type_counts)
+
+    @classmethod
+    def from_tables(cls, tables):
+        """由索引檔中的比對表還原引擎"""
+        engine = cls()
+        engine.rule_meta, engine.type_counts, engine.trie, engine.fallback_ids, engine.descriptions = tables
+        return engine
+
+    def to_tables(self):
+        """輸出可由 marshal 序列化的比對表"""
+        return (self.rule_meta, self.type_counts, self.trie, self.fallback_ids, self.descriptions)
+
+    def _insert(self, words, rule_id):
+        """將規則的單詞序列加入前綴樹"""
+        children = self.trie
+        node = None
+        for word in words:
+            node = children.get(word)
+            if node is None:
+                node = [[], {}]
+                children[word] = node
+            children = node[1]
+        node[0].append(rule_id)
+
+    def _compiled_fallbacks(self, flexible_whitespace):
+        """取得（必要時編譯）特殊格式規則的正則表達式"""
+        patterns = self._fallback_patterns.get(flexible_whitespace)
+        if patterns is None:
+            patterns = []
+            for rule_id in self.fallback_ids:
+                original = self.rule_meta[rule_id][1]
+                try:
+                    patterns.append((rule_id, re.compile(build_rule_pattern(original, flexible_whitespace))))
+                except re.error as e:
+                    print(f"編譯規則 '{original}' 時出錯: {e}", file=sys.stderr)
+            self._fallback_patterns[flexible_whitespace] = patterns
+        return patterns
+
+    def _iter_trie_matches(self, text, flexible_whitespace):
+        """單次掃描文章，對每個命中的前綴樹節點產生 (規則編號列表, 起始單詞序號, 結束單詞序號, 單詞的 match 物件列表)"""
+        matches = list(WORD_RE.finditer(text))
+        words = [m.group().lower() for m in matches]
+
+        # gap_ok[i] 表示第 i 與第 i+1 個單詞之間的字元是否符合短語的空白要求
+        gap_ok = []
+        for current, following in zip(matches, matches[1:]):
+            gap = text[current.end():following.start()]
+            gap_ok.append(gap.isspace() if flexible_whitespace else gap == ' ')
+
+        word_total = len(words)
+        for start, word in enumerate(words):
+            node = self.trie.get(word)
+            position = start
+            while node is not None:
+                if node[0]:
+                    yield node[0], start, position, matches
+                if position + 1 >= word_total or not gap_ok[position] or not node[1]:
+                    break
+                position += 1
+                node = node[1].get(words[position])
+
+    def match_rule_ids(self, text, flexible_whitespace=True):
+        """單次掃描文章，返回所有命中的規則編號（已排序）"""
+        matched = set()
+        for rule_ids, _, _, _ in self._iter_trie_matches(text, flexible_whitespace):
+            matched.update(rule_ids)
+
+        for rule_id, pattern in self._compiled_fallbacks(flexible_whitespace):
+            if pattern.search(text):
+                matched.add(rule_id)
+
+        return sorted(matched)
+
+    def match_spans(self, text, flexible_whitespace=True):
+        """單次掃描文章，返回每一處命中的 (起始字元, 結束字元, 規則編號)，依位置排序"""
+        spans = []
+        for rule_ids, start, end, word_matches in self._iter_trie_matches(text, flexible_whitespace):
+            span_start = word_matches[start].start()
+            span_end = word_matches[end].end()
+            spans.extend((span_start, span_end, rule_id) for rule_id in rule_ids)
+
+        for rule_id, pattern in self._compiled_fallbacks(flexible_whitespace):
+            spans.extend((m.start(), m.end(), rule_id) for m in pattern.finditer(text))
+
+        spans.sort()
+        return spans
+
+    def find_issues(self, text, flexible_whitespace=True, require_corrected=True):
+        """
+        返回 {錯誤類型: [建議字串, ...]}，內容與順序與逐條規則比對相同
+
+        require_corrected=True 時略過沒有 corrected 的規則（score_essay / test_grammar 的行為）；
+        為 False 時改為略過空白的 original，並以空字串作為更正（enhanced_feedback 的行為）。
+        """
+        issues = {}
+        for rule_id in self.match_rule_ids(text, flexible_whitespace):
+            error_type, original, corrected = self.rule_meta[rule_id]
+            if require_corrected:
+                if corrected is None:
+                    continue
+            elif not original:
+                continue
+            elif corrected is None:
+                corrected = ""
+
+            suggestion = format_suggestion(original, corrected)
+            found_issues = issues.setdefault(error_type, [])
+            if suggestion not in found_issues:
+                found_issues.append(suggestion)
+
+        return issues
+
+
+# 最近一次編譯的規則與引擎；同一份 rules 物件重複檢查時不需重新編譯
+_engine_cache = (None, None)
+
+
+def get_compiled_engine(rules):
+    """取得 rules 對應的編譯引擎，同一個 rules 物件只會編譯一次（請勿就地修改已編譯的 rules）"""
+    global _engine_cache
+    if isinstance(rules, CompiledRuleEngine):
+        return rules
+
+    cached_rules, cached_engine = _engine_cache
+    if cached_rules is rules and cached_engine is not None:
+        return cached_engine
+
+    engine = CompiledRuleEngine(rules)
+    _engine_cache = (rules, engine)
+    return engine
+
+
+def rule_index_path(rules_path):
+    """規則 pickle 對應的索引檔路徑"""
+    return os.path.splitext(rules_path)[0] + INDEX_SUFFIX
+
+
+def file_sha256(path):
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_rules_data(data):
+    """將 pickle 內容拆成 (rules, descriptions)"""
+    if isinstance(data, dict) and "rules" in data:
+        return data["rules"] or {}, data.get("descriptions")
+    if isinstance(data, dict):
+        return data, None
+    return {}, None
+
+
+def write_rule_index(engine, index_path, source_hash, source_stat):
+    """將編譯後的引擎寫入索引檔（先寫暫存檔再替換，避免讀到寫一半的檔案）"""
+    header = json.dumps({
+        'marshal_version': marshal.version,
+        'source_sha256': source_hash,
+        'source_size': source_stat.st_size,
+        'source_mtime_ns': source_stat.st_mtime_ns
+    }).encode('utf-8')
+    payload = marshal.dumps(engine.to_tables())
+
+    # 每次寫入使用唯一的暫存檔，同一行程的多個執行緒同時重建時不會寫到同一個檔案
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_path)),
+                                     prefix=os.path.basename(index_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(INDEX_PREFIX.pack(INDEX_MAGIC, INDEX_VERSION, len(header)))
+            f.write(header)
+            f.write(payload)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_rule_index(index_path, source_path):
+    """
+    讀取索引檔並返回引擎；索引不存在、格式或 marshal 版本不符或來源已變更時返回 None
+
+    來源檔的大小與修改時間都相同時直接信任索引，否則再比對內容雜湊，
+    因此只是被 touch 過的規則檔不會觸發重建。
+    """
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, 'rb') as f:
+        prefix = f.read(INDEX_PREFIX.size)
+        if len(prefix) < INDEX_PREFIX.size:
+            return None
+        magic, version, header_len = INDEX_PREFIX.unpack(prefix)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            return None
+
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        # 不同 Python 版本的 marshal 格式不保證相容
+        if header.get('marshal_version') != marshal.version:
+            return None
+
+        stat = os.stat(source_path)
+        stat_changed = (header.get('source_size') != stat.st_size
+                        or header.get('source_mtime_ns') != stat.st_mtime_ns)
+        if stat_changed and header.get('source_sha256') != file_sha256(source_path):
+            return None
+
+        tables = marshal.loads(f.read())
+
+    engine = CompiledRuleEngine.from_tables(tables)
+
+    # 內容未變但檔案狀態不同（例如被複製或 touch 過）時更新標頭，下次就不必再計算雜湊
+    if stat_changed:
+        try:
+            write_rule_index(engine, index_path, header['source_sha256'], stat)
+        except (OSError, ValueError):
+            pass
+
+    return engine
+
+
+def load_rule_engine(rules_path):
+    """
+    載入規則檔對應的編譯引擎
+
+    優先使用同目錄下的索引檔；索引缺少或過期時解開 pickle 重新編譯並寫回索引。
+    """
+    index_path = rule_index_path(rules_path)
+    try:
+        engine = read_rule_index(index_path, rules_path)
+        if engine is not None:
+            return engine
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        print(f"規則索引 {index_path} 無法使用，將重新建立: {e}", file=sys.stderr)
+
+    # 先取得檔案狀態再讀內容，來源在讀取期間被改寫時下次載入仍會發現
+    source_stat = os.stat(rules_path)
+    with open(rules_path, 'rb') as f:
+        raw = f.read()
+    rules, descriptions = split_rules_data(pickle.loads(raw))
+    engine = CompiledRuleEngine(rules, descriptions)
+
+    try:
+        write_rule_index(engine, index_path, hashlib.sha256(raw).hexdigest(), source_stat)
+    except (OSError, ValueError) as e:
+        # ValueError：規則內容含有 marshal 無法序列化的物件，只使用記憶體中的引擎
+        print(f"無法寫入規則索引 {index_path}: {e}", file=sys.stderr)
+
+    return engine
+
+
+class RuleEngineCache:
+    """
+    常駐程序使用的引擎快取：依候選路徑找出第一個存在的規則檔，
+    規則檔的大小或修改時間改變時才重新載入，其餘時間直接返回已載入的引擎
+
+    可由多個執行緒共用：每個規則檔有自己的鎖，同時未命中的請求只有一個會載入（並寫入索引），
+    其餘等待後直接使用載入結果；不同規則檔的載入互不阻擋。
+    規則檔載入失敗時改用下一個候選路徑。
+    """
+
+    def __init__(self):
+        # {規則檔路徑: ((大小, 修改時間), 引擎)}
+        self._engines = {}
+        # {規則檔路徑: threading.Lock}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _path_lock(self, path):
+        with self._locks_lock:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.Lock()
+            return lock
+
+    def get(self, paths):
+        """返回候選路徑中第一個能載入的規則檔對應的引擎；都無法載入時返回空引擎"""
+        for path in paths:
+            if not path or not os.path.exists(path):
+                continue
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+
+            # 載入失敗的規則檔記錄為 None，檔案改變前不再重試
+            cached = self._engines.get(path)
+            if cached is not None and cached[0] == signature:
+                if cached[1] is None:
+                    continue
+                return cached[1]
+
+            with self._path_lock(path):
+                # 等待鎖的期間其他執行緒可能已載入
+                cached = self._engines.get(path)
+                if cached is not None and cached[0] == signature:
+                    engine = cached[1]
+                else:
+                    try:
+                        engine = load_rule_engine(path)
+                    except Exception as e:
+                        print(f"載入規則檔 {path} 失敗: {e}", file=sys.stderr)
+                        engine = None
+                    self._engines[path] = (signature, engine)
+            if engine is not None:
+                return engine
+
+        return CompiledRuleEngine()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+共用的平行運算設定 - grammar_analyzer.py、train_model.py 與 process_asap_data.py 使用相同的 worker 數
+
+以環境變數 ESSAY_N_JOBS 設定（命令列工具另有 --n_jobs 參數），值的意義與 scikit-learn 的
+n_jobs 相同：-1 為使用全部核心，1 為單一核心。個別用途可再以
+ESSAY_N_JOBS_FIT / ESSAY_N_JOBS_PREDICT / ESSAY_N_JOBS_CV / ESSAY_N_JOBS_EXTRACT 覆寫。
+
+預測 (predict) 預設只用一個核心，且不受 ESSAY_N_JOBS 影響：服務端每次只預測一篇文章，
+又有多個 worker 行程同時處理請求，使用全部核心只會互相搶用 CPU；需要時以 ESSAY_N_JOBS_PREDICT 設定。
+"""
+
+import os
+
+N_JOBS_ENV = 'ESSAY_N_JOBS'
+DEFAULT_N_JOBS = -1
+
+# 用途：模型擬合、預測、交叉驗證、文法規則提取
+ROLES = ('fit', 'predict', 'cv', 'extract')
+
+# 各用途的預設值（未列出者為 DEFAULT_N_JOBS）
+ROLE_DEFAULTS = {'predict': 1}
+
+# 只讀取自己的環境變數、不沿用 ESSAY_N_JOBS 的用途
+ISOLATED_ROLES = ('predict',)
+
+
+def _parse_n_jobs(value):
+    try:
+        n_jobs = int(value)
+    except (TypeError, ValueError):
+        return None
+    return n_jobs if n_jobs != 0 else None
+
+
+def get_n_jobs(role='fit'):
+    """取得指定用途的 worker 數"""
+    names = [f"{N_JOBS_ENV}_{role.upper()}"]
+    if role not in ISOLATED_ROLES:
+        names.append(N_JOBS_ENV)
+    for name in names:
+        n_jobs = _parse_n_jobs(os.environ.get(name))
+        if n_jobs is not None:
+            return n_jobs
+    return ROLE_DEFAULTS.get(role, DEFAULT_N_JOBS)
+
+
+def set_n_jobs(n_jobs):
+    """設定預測以外所有用途的 worker 數（寫入環境變數，子行程也會沿用）"""
+    if _parse_n_jobs(n_jobs) is not None:
+        os.environ[N_JOBS_ENV] = str(int(n_jobs))
+
+
+def effective_n_jobs(n_jobs):
+    """實際使用的核心數（-1 為全部核心，-2 為保留一個核心，依此類推）"""
+    cpu_count = os.cpu_count() or 1
+    if n_jobs < 0:
+        return max(1, cpu_count + 1 + n_jobs)
+    return n_jobs
+
+
+def add_n_jobs_argument(parser):
+    """為命令列工具加上 --n_jobs 參數"""
+    parser.add_argument('--n_jobs', type=int, default=None,
+                        help=f'平行運算的 worker 數 (-1 為全部核心，預設為環境變數 {N_JOBS_ENV} 或 {DEFAULT_N_JOBS})')
+
+
+def apply_n_jobs(estimator, role):
+    """將指定用途的 worker 數設定到支援 n_jobs 的模型上，返回模型本身"""
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=get_n_jobs(role))
+    return estimator
@@ -7,19 +7,59 @@ import os
 import pickle
 import re
 import sys
+import zlib
+import argparse
+import codecs
 import numpy as np
-from collections import defaultdict
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+
+from edit_extraction import REPLACE, extract_edits
+from grammar_rule_engine import load_rule_engine, rule_index_path
+from parallel_config import add_n_jobs_argument, effective_n_jobs, get_n_jobs
+
+# 每個分片的行數（平行提取錯誤模式時的工作單位）
+DEFAULT_SHARD_SIZE = 2000
+
+# 每個錯誤模式保留的例句數上限
+DEFAULT_MAX_EXAMPLES = 10
+
+# 嘗試的編碼清單（依序）
+DEV_FILE_ENCODINGS = ['utf-8', 'latin-1', 'windows-1252', 'cp950']
+
+# 偵測編碼時讀取的檔案開頭位元組數
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
+# 已偵測編碼的資料檔
+DevFile = namedtuple('DevFile', ['path', 'encoding'])
+
+def detect_encoding(path, encodings=DEV_FILE_ENCODINGS, sample_bytes=ENCODING_SAMPLE_BYTES):
+    """以檔案開頭的樣本判斷編碼，返回第一個能解碼樣本的編碼；都無法解碼時返回 None"""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    
+    for encoding in encodings:
+        # 樣本結尾可能切在多位元組字元中間，使用增量解碼器不把結尾視為錯誤
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            print(f"使用 {encoding} 編碼載入失敗")
+    return None
 
 def load_dev_files(file_names):
-    """載入 dev.src 和 dev.ref* 檔案"""
+    """
+    找出 dev.src 和 dev.ref* 檔案並偵測各自的編碼（不讀取整個檔案）
+    返回 {'src': DevFile 或 None, 'refs': [DevFile, ...]}，以 iter_dev_lines 串流讀取內容
+    """
     data = {
-        'src': [],
+        'src': None,
         'refs': []
     }
     
-    # 嘗試的編碼清單
-    encodings = ['utf-8', 'latin-1', 'windows-1252', 'cp950']
-    
     # 取得項目根目錄路徑
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     data_dir = os.path.join(project_root, 'data', 'essays')
@@ -33,113 +73,245 @@ def load_dev_files(file_names):
         data_dir = os.getcwd()
         print(f"使用當前目錄作為資料目錄: {data_dir}")
     
-    # 讀取 dev.src 檔案
     for file_name in file_names:
+        if file_name != 'dev.src' and not file_name.startswith('dev.ref'):
+            continue
+        path = os.path.join(data_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        try:
+            # 空的參考檔不使用
+            if file_name != 'dev.src' and os.path.getsize(path) == 0:
+                continue
+            encoding = detect_encoding(path)
+        except Exception as e:
+            print(f"載入 {path} 時發生錯誤: {str(e)}")
+            continue
+        if encoding is None:
+            continue
+        
+        print(f"使用 {encoding} 編碼讀取 {path}")
         if file_name == 'dev.src':
-            src_path = os.path.join(data_dir, file_name)
-            if os.path.exists(src_path):
-                for encoding in encodings:
-                    try:
-                        with open(src_path, 'r', encoding=encoding) as f:
-                            data['src'] = f.readlines()
-                        print(f"成功使用 {encoding} 編碼載入 {src_path}，共 {len(data['src'])} 行")
-                        break
-                    except UnicodeDecodeError:
-                        print(f"使用 {encoding} 編碼載入失敗")
-                    except Exception as e:
-                        print(f"載入 {src_path} 時發生錯誤: {str(e)}")
-        elif file_name.startswith('dev.ref'):
-            ref_path = os.path.join(data_dir, file_name)
-            if os.path.exists(ref_path):
-                for encoding in encodings:
-                    try:
-                        with open(ref_path, 'r', encoding=encoding) as f:
-                            refs = f.readlines()
-                        if refs:
-                            data['refs'].append(refs)
-                        print(f"成功使用 {encoding} 編碼載入 {ref_path}，共 {len(refs)} 行")
-                        break
-                    except UnicodeDecodeError:
-                        print(f"使用 {encoding} 編碼載入失敗")
-                    except Exception as e:
-                        print(f"載入 {ref_path} 時發生錯誤: {str(e)}")
+            data['src'] = DevFile(path, encoding)
+        else:
+            data['refs'].append(DevFile(path, encoding))
     
     return data
 
-def extract_error_patterns(src_sentences, ref_sentences_list, verbose=True):
-    """分析原始句子和校正句子的差異，提取錯誤模式"""
-    if verbose:
-        print(f"開始分析錯誤模式，源句子: {len(src_sentences)}，參考句子集: {len(ref_sentences_list)}")
-    
-    error_patterns = defaultdict(list)
-    
-    # 如果沒有足夠的資料，返回空結果
-    if not src_sentences or not ref_sentences_list:
-        print("警告: 沒有足夠的資料進行分析")
-        return error_patterns
-    
+def iter_dev_lines(src_file, ref_files):
+    """
+    串流讀取 dev.src 與各 dev.ref*，逐行產生 (源句子, (各參考集的同一行, ...))
+    參考檔比源檔短時，缺少的行為 None；記憶體用量與檔案大小無關
+    編碼只依檔案開頭判斷，之後無法解碼的位元組以替代字元取代
+    """
+    with ExitStack() as stack:
+        src = stack.enter_context(open(src_file.path, 'r', encoding=src_file.encoding, errors='replace'))
+        refs = [stack.enter_context(open(ref_file.path, 'r', encoding=ref_file.encoding, errors='replace'))
+                for ref_file in ref_files]
+        for src_line in src:
+            yield src_line, tuple(next(ref, None) for ref in refs)
+
+def align_lines(src_sentences, ref_sentences_list):
+    """將已載入記憶體的句子列表轉成與 iter_dev_lines 相同格式的逐行資料"""
     for i, src in enumerate(src_sentences):
+        yield src, tuple(ref_set[i] if i < len(ref_set) else None for ref_set in ref_sentences_list)
+
+def _example_priority(example):
+    """例句的抽樣優先序：以內容的雜湊值決定，相同例句永遠得到相同的優先序"""
+    return zlib.crc32(example.encode('utf-8')), example
+
+class PatternAggregate:
+    """
+    單一錯誤模式（同一類型、同一原始片段）的累計資料，隨出現就地更新
+    
+    更正片段以列表保留第一次出現的順序，另以集合判斷是否已存在；
+    例句只保留 max_examples 個：取優先序（內容雜湊）最小的例句，等同固定大小的隨機抽樣，
+    且不論資料如何分片、以何種順序合併，結果都相同。
+    """
+    
+    __slots__ = ('original', 'context', 'corrected', 'corrected_set', 'confidence',
+                 'count', 'agreement', 'examples', 'max_examples')
+    
+    def __init__(self, original, context, max_examples):
+        self.original = original
+        self.context = context
+        self.corrected = []
+        self.corrected_set = set()
+        self.confidence = None
+        self.count = 0
+        self.agreement = 0
+        # [(優先序, 例句), ...]，未排序
+        self.examples = []
+        self.max_examples = max_examples
+    
+    def _add_corrected(self, corrected):
+        if corrected not in self.corrected_set:
+            self.corrected_set.add(corrected)
+            self.corrected.append(corrected)
+    
+    def _offer_example(self, entry):
+        """entry 為 (優先序, 例句)；抽樣已滿時只有優先序比目前最大者小的例句才會取代它"""
+        if len(self.examples) >= self.max_examples:
+            worst = max(self.examples)
+            if entry >= worst:
+                return
+            if entry not in self.examples:
+                self.examples[self.examples.index(worst)] = entry
+        elif entry not in self.examples:
+            self.examples.append(entry)
+    
+    def add(self, corrected, confidence, agreement, example_entry):
+        """記錄一次出現"""
+        self.count += 1
+        self._add_corrected(corrected)
+        # 取較高的信心分數與一致數
+        self.confidence = confidence if self.confidence is None else max(self.confidence, confidence)
+        self.agreement = max(self.agreement, agreement)
+        self._offer_example(example_entry)
+    
+    def merge(self, other):
+        """合併另一個分片中同一模式的累計資料（other 在資料中位於 self 之後）"""
+        self.count += other.count
+        for corrected in other.corrected:
+            self._add_corrected(corrected)
+        self.confidence = max(self.confidence, other.confidence)
+        self.agreement = max(self.agreement, other.agreement)
+        for entry in other.examples:
+            self._offer_example(entry)
+    
+    def to_rule(self):
+        """轉換為保存到 grammar_rules.pkl 的規則格式"""
+        return {
+            'original': self.original,
+            'corrected': list(self.corrected),
+            'confidence': self.confidence,
+            'context': {'left': self.context['left'], 'right': self.context['right']},
+            'count': self.count,
+            'examples': [example for _, example in sorted(self.examples)],
+            'agreement': self.agreement
+        }
+
+def _collect_shard_patterns(lines, max_examples=DEFAULT_MAX_EXAMPLES):
+    """
+    分析一段連續的 (源句子, 參考句子們) 資料，返回錯誤模式表：
+    {錯誤類型: {原始片段: PatternAggregate}}，字典順序即為第一次出現的順序
+    """
+    table = {}
+    
+    for src, refs in lines:
         src = src.strip()
         if not src:
             continue
         
-        # 對於每個源句子，檢查對應的所有參考句子
-        for ref_set in ref_sentences_list:
-            if i < len(ref_set):
-                ref = ref_set[i].strip()
-                if ref and src != ref:  # 只處理不同的句子
-                    # 提取差異
-                    differences = identify_differences(src, ref)
+        # 每個參考句子只比對一次，並統計各參考集對每個更正的一致數
+        ref_differences, agreement, total_refs = align_references(src, refs)
+        if not ref_differences:
+            continue
+        example_entry = (_example_priority(src), src)
+        
+        for differences in ref_differences:
+            # 對每種錯誤類型記錄差異，相同的錯誤模式就地累計
+            for error_type, errors in differences.items():
+                for original, corrected in errors:
+                    patterns = table.setdefault(error_type, {})
+                    pattern = patterns.get(original)
+                    if pattern is None:
+                        # 上下文只取第一次出現的句子
+                        pattern = PatternAggregate(original, extract_context(src, original), max_examples)
+                        patterns[original] = pattern
                     
-                    # 對每種錯誤類型記錄差異
-                    for error_type, errors in differences.items():
-                        for original, corrected in errors:
-                            # 計算信心分數 - 基於多個參考集的一致性
-                            confidence = calculate_confidence(src, original, corrected, ref_sentences_list, i)
-                            
-                            # 記錄錯誤模式
-                            error_patterns[error_type].append({
-                                'original': original,
-                                'corrected': [corrected],
-                                'confidence': confidence,
-                                'context': extract_context(src, original),
-                                'count': 1,
-                                'examples': [src]
-                            })
-    
-    # 合併相同的錯誤模式
-    merged_patterns = defaultdict(list)
-    for error_type, patterns in error_patterns.items():
-        merged = {}
-        for pattern in patterns:
-            key = pattern['original']
+                    agreement_count = agreement[(original, corrected)]
+                    pattern.add(corrected, calculate_confidence(agreement_count, total_refs),
+                                agreement_count, example_entry)
+    
+    return table
+
+def _extract_shard(shard, max_examples=DEFAULT_MAX_EXAMPLES):
+    """worker 行程執行的 map 步驟：shard 為 [(源句子, 參考句子們), ...]"""
+    return _collect_shard_patterns(shard, max_examples)
+
+def _merge_pattern_table(merged_table, table):
+    """
+    reduce 步驟：把下一個分片的模式表依序合併進 merged_table
+    次數相加、更正依出現順序聯集、例句重新抽樣、信心分數與一致數取較高者
+    """
+    for error_type, patterns in table.items():
+        merged = merged_table.setdefault(error_type, {})
+        for key, pattern in patterns.items():
             if key in merged:
-                # 更新已存在的模式
-                merged[key]['count'] += 1
-                if pattern['corrected'][0] not in merged[key]['corrected']:
-                    merged[key]['corrected'].append(pattern['corrected'][0])
-                if pattern['examples'][0] not in merged[key]['examples']:
-                    merged[key]['examples'].append(pattern['examples'][0])
-                # 取較高的信心分數
-                merged[key]['confidence'] = max(merged[key]['confidence'], pattern['confidence'])
+                merged[key].merge(pattern)
             else:
-                # 添加新模式
                 merged[key] = pattern
-        
-        # 將合併後的模式轉換為列表
-        merged_patterns[error_type] = list(merged.values())
-        
-        # 按出現頻率排序
-        merged_patterns[error_type].sort(key=lambda x: x['count'], reverse=True)
+
+def _iter_shards(lines, shard_size):
+    """依行號範圍切分逐行資料，每個分片為 shard_size 行的列表"""
+    lines = iter(lines)
+    while True:
+        shard = list(islice(lines, shard_size))
+        if not shard:
+            return
+        yield shard
+
+def extract_error_patterns(lines, verbose=True, n_jobs=None, shard_size=DEFAULT_SHARD_SIZE,
+                           max_examples=DEFAULT_MAX_EXAMPLES):
+    """
+    分析原始句子和校正句子的差異，提取錯誤模式
+    
+    lines 為逐行的 (源句子, (各參考集的同一行, ...))，可直接使用 iter_dev_lines 的串流，
+    已載入記憶體的列表可用 align_lines 轉換。
+    資料依行號切成每 shard_size 行一個分片，由 n_jobs 個 worker 行程分別提取（map），
+    再依分片順序合併（reduce），結果與單一行程依序處理完全相同。
+    n_jobs 預設使用 parallel_config 的設定；同時處理中的分片數有上限，記憶體用量不隨語料大小增加。
+    每個模式最多保留 max_examples 個例句（固定大小的抽樣）。
+    """
+    shard_size = max(1, shard_size)
+    max_examples = max(1, max_examples)
+    workers = effective_n_jobs(get_n_jobs('extract') if n_jobs is None else n_jobs)
+    if verbose:
+        print(f"開始分析錯誤模式，每個分片 {shard_size} 行，使用 {workers} 個行程")
+    
+    line_count = 0
+    merged_table = {}
+    shards = _iter_shards(lines, shard_size)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 依序取回結果並合併，同時最多只有 2 * workers 個分片在處理中
+            pending = deque()
+            for shard in shards:
+                line_count += len(shard)
+                pending.append(pool.submit(_extract_shard, shard, max_examples))
+                if len(pending) >= 2 * workers:
+                    _merge_pattern_table(merged_table, pending.popleft().result())
+            while pending:
+                _merge_pattern_table(merged_table, pending.popleft().result())
+    else:
+        for shard in shards:
+            line_count += len(shard)
+            _merge_pattern_table(merged_table, _extract_shard(shard, max_examples))
+    
+    # 如果沒有資料，返回空結果
+    if not line_count:
+        print("警告: 沒有足夠的資料進行分析")
+        return defaultdict(list)
+    
+    # 將合併後的模式轉換為列表，按出現頻率排序
+    merged_patterns = defaultdict(list)
+    for error_type, merged in merged_table.items():
+        merged_patterns[error_type] = sorted((pattern.to_rule() for pattern in merged.values()),
+                                             key=lambda x: x['count'], reverse=True)
     
     if verbose:
+        print(f"共分析 {line_count} 行源句子")
         for error_type, patterns in merged_patterns.items():
             print(f"找到 {error_type} 類型的錯誤: {len(patterns)} 個")
     
     return merged_patterns
 
-def identify_differences(src, ref):
-    """識別原始句子和校正句子之間的差異"""
+def identify_differences(src, ref, aligner='myers'):
+    """
+    識別原始句子和校正句子之間的差異
+    aligner 為 'myers'（edit_extraction 的單詞比對）或 'difflib'（原本的 SequenceMatcher 比對，供效能測試對照）
+    """
     differences = {
         'spelling': [],
         'grammar': [],
@@ -152,26 +324,36 @@ def identify_differences(src, ref):
         'plurals': []
     }
     
+    if aligner == 'difflib':
+        edits = _difflib_edits(src, ref)
+    else:
+        # 只取替換類型的編輯（純插入或刪除沒有可比對的原始片段）
+        edits = [(edit.original, edit.corrected)
+                 for edit in extract_edits(src.lower(), ref.lower()) if edit.type == REPLACE]
+    
+    for src_text, ref_text in edits:
+        # 分類錯誤類型
+        error_type = classify_error(src_text, ref_text)
+        differences[error_type].append((src_text, ref_text))
+    
+    return differences
+
+def _difflib_edits(src, ref):
+    """原本以 SequenceMatcher 比對單詞與空白、標點片段的做法，返回 [(原始片段, 更正片段), ...]"""
     # 拆分為單詞
     src_words = re.findall(r'\b\w+\b|\W+', src.lower())
     ref_words = re.findall(r'\b\w+\b|\W+', ref.lower())
     
-    # 使用最長公共子序列算法找出差異
-    diff_regions = find_diff_regions(src_words, ref_words)
-    
-    for src_region, ref_region in diff_regions:
+    edits = []
+    for src_region, ref_region in find_diff_regions(src_words, ref_words):
         # 組合區域中的單詞
         src_text = ''.join(src_words[src_region[0]:src_region[1]]).strip()
         ref_text = ''.join(ref_words[ref_region[0]:ref_region[1]]).strip()
         
-        if not src_text or not ref_text:
-            continue
-        
-        # 分類錯誤類型
-        error_type = classify_error(src_text, ref_text)
-        differences[error_type].append((src_text, ref_text))
+        if src_text and ref_text:
+            edits.append((src_text, ref_text))
     
-    return differences
+    return edits
 
 def find_diff_regions(src_words, ref_words):
     """使用最長公共子序列算法找出差異區域"""
@@ -230,11 +412,12 @@ def classify_error(original, corrected):
         (r'\b(\w+)\b', r'\b\1s\b')
     ]
     
+    # 參考模式中的 \1 代表原始句子中匹配到的詞幹；re.search 不接受沒有對應群組的 \1
+    # (會引發 re.error)，因此先代換成跳脫後的詞幹再比對
     for src_pattern, ref_pattern in plural_indicators:
-        src_matches = re.findall(src_pattern, original)
-        ref_matches = re.findall(ref_pattern, corrected)
-        if src_matches and ref_matches:
-            return 'plurals'
+        for stem in re.findall(src_pattern, original):
+            if re.search(ref_pattern.replace(r'\1', re.escape(stem)), corrected):
+                return 'plurals'
     
     # 拼寫錯誤 - 如果長度相近但有差異
     if len(original) > 3 and len(corrected) > 3:
@@ -256,20 +439,38 @@ def classify_error(original, corrected):
     # 默認為詞語選擇問題
     return 'word_choice'
 
-def calculate_confidence(src, original, corrected, ref_sentences_list, index):
-    """計算規則的信心分數 - 基於多個參考集的一致性"""
-    agreement_count = 0
+def align_references(src, refs):
+    """
+    將源句子與同一行的所有參考句子各比對一次
+    
+    返回 (各參考句子的差異列表, 一致數, 有效參考數)：
+    - 差異列表只包含與源句子不同的參考句子，格式同 identify_differences
+    - 一致數為 Counter，(原始片段, 更正片段) -> 做了相同更正的參考句子數
+    - 有效參考數為非空白的參考句子數（包含與源句子相同、不需更正的參考）
+    """
+    ref_differences = []
+    agreement = Counter()
     total_refs = 0
     
-    for ref_set in ref_sentences_list:
-        if index < len(ref_set):
-            ref = ref_set[index].strip()
-            if ref:
-                total_refs += 1
-                # 檢查這個參考是否也做了相同的更正
-                if original in src and corrected in ref:
-                    agreement_count += 1
+    for ref in refs:
+        if ref is None:
+            continue
+        ref = ref.strip()
+        if not ref:
+            continue
+        total_refs += 1
+        if ref == src:  # 只處理不同的句子
+            continue
+        
+        differences = identify_differences(src, ref)
+        ref_differences.append(differences)
+        # 同一參考句子中重複的更正只計一次
+        agreement.update({edit for errors in differences.values() for edit in errors})
     
+    return ref_differences, agreement, total_refs
+
+def calculate_confidence(agreement_count, total_refs):
+    """計算規則的信心分數 - 基於多個參考集的一致性（做了相同更正的參考數 / 有效參考數）"""
     # 如果只有一個參考集或沒有參考，給予中等信心
     if total_refs <= 1:
         return 0.7
@@ -330,6 +531,14 @@ def save_grammar_rules(rules, output_path, descriptions):
             pickle.dump(grammar_rules, f)
         
         print(f"文法規則已保存至 {output_path}")
+        
+        # 同時重建規則索引，讓評分腳本下次執行時直接使用
+        try:
+            load_rule_engine(output_path)
+            print(f"規則索引已更新: {rule_index_path(output_path)}")
+        except Exception as e:
+            print(f"更新規則索引失敗（評分時會自動重建）: {e}")
+        
         return True
     except Exception as e:
         print(f"保存文法規則失敗: {e}")
@@ -399,6 +608,12 @@ def generate_basic_rules():
 
 def main():
     """主函數：處理資料集並提取文法規則"""
+    parser = argparse.ArgumentParser(description='從 dev.src 和 dev.ref* 檔案提取文法規則')
+    parser.add_argument('--shard_size', type=int, default=DEFAULT_SHARD_SIZE, help='每個分片的行數')
+    parser.add_argument('--max_examples', type=int, default=DEFAULT_MAX_EXAMPLES, help='每個錯誤模式保留的例句數上限')
+    add_n_jobs_argument(parser)
+    args = parser.parse_args()
+    
     print("=== 開始處理資料集並提取文法規則 ===")
     
     # 定義資料檔案
@@ -418,7 +633,8 @@ def main():
     error_patterns = {}
     if use_loaded_data:
         print("\n分析錯誤模式中...")
-        error_patterns = extract_error_patterns(data['src'], data['refs'])
+        error_patterns = extract_error_patterns(iter_dev_lines(data['src'], data['refs']), n_jobs=args.n_jobs,
+                                                shard_size=args.shard_size, max_examples=args.max_examples)
     
     # 如果沒有足夠的規則，使用基本規則
     if not error_patterns or sum(len(patterns) for patterns in error_patterns.values()) < 10:
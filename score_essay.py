@@ -7,46 +7,35 @@
 import sys
 import os
 import re
-import pickle
 import json
 import argparse
+import contextlib
 
-def load_grammar_rules(file_path=None):
-    """載入儲存的文法規則"""
-    # 預設路徑
-    default_paths = [
-        'D:/xampp/htdocs/Project/models/grammar_rules.pkl',  # 使用您的絕對路徑
-        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
-        os.path.join('models', 'grammar_rules.pkl'),
-        os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
-    ]
-    
-    # 如果指定了文件路徑，優先嘗試
-    if file_path and os.path.exists(file_path):
-        try:
-            print(f"嘗試從指定路徑載入: {file_path}")
-            with open(file_path, 'rb') as f:
-                data = pickle.load(f)
-                if isinstance(data, dict) and "rules" in data:
-                    return data["rules"]
-                return data.get("rules", {})
-        except Exception as e:
-            print(f"無法從指定路徑載入規則: {e}", file=sys.stderr)
+import grammar_batch
+import grammar_daemon
+from grammar_rule_engine import CompiledRuleEngine, get_compiled_engine, load_rule_engine
+
+# 預設規則路徑
+DEFAULT_RULES_PATHS = [
+    'D:/xampp/htdocs/Project/models/grammar_rules.pkl',  # 使用您的絕對路徑
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
+    os.path.join('models', 'grammar_rules.pkl'),
+    os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
+]
+
+def load_compiled_rules(file_path=None):
+    """載入編譯後的文法規則（優先使用規則索引檔，避免每次都解開 pickle）"""
+    paths = ([file_path] if file_path else []) + DEFAULT_RULES_PATHS
     
-    # 嘗試預設路徑
-    for path in default_paths:
+    for path in paths:
         if os.path.exists(path):
             try:
                 print(f"嘗試從路徑載入: {path}")
-                with open(path, 'rb') as f:
-                    data = pickle.load(f)
-                    if isinstance(data, dict) and "rules" in data:
-                        return data["rules"]
-                    return data.get("rules", {})
+                return load_rule_engine(path)
             except Exception as e:
                 print(f"載入文件 {path} 失敗: {e}", file=sys.stderr)
     
-    return {}
+    return CompiledRuleEngine()
 
 def check_grammar_issues(text, rules=None):
     """檢查文本中的文法問題，優化英文文法檢測"""
@@ -54,48 +43,24 @@ def check_grammar_issues(text, rules=None):
     
     # 如果未提供規則，則載入預設規則
     if rules is None:
-        rules = load_grammar_rules()
+        rules = load_compiled_rules()
     
     # 如果沒有規則，則返回空結果
     if not rules:
         print("無法載入任何文法規則")
         return issues
     
-    print(f"成功載入規則，類型數: {len(rules)}")
-    for type_name, type_rules in rules.items():
-        print(f"  - {type_name}: {len(type_rules)} 條規則")
-    
-    # 針對每種錯誤類型檢查
-    for error_type, type_rules in rules.items():
-        found_issues = []
-        for rule in type_rules:
-            # 確保規則格式正確
-            if 'original' not in rule or 'corrected' not in rule or not rule['corrected']:
-                continue
-            
-            original = rule['original']
-            
-            try:
-                # 對於短語類型的錯誤，使用更寬鬆的匹配方式
-                if ' ' in original:
-                    # 允許短語中間有變化的字詞間距
-                    pattern = r'(?i)\b' + re.escape(original).replace(r'\ ', r'\s+') + r'\b'
-                else:
-                    pattern = r'(?i)\b' + re.escape(original) + r'\b'
-                
-                matches = re.findall(pattern, text)
-                
-                if matches:
-                    corrected = rule['corrected'][0] if rule['corrected'] else ""
-                    suggestion = f"'{original}' 可能應為 '{corrected}'"
-                    if suggestion not in found_issues:
-                        found_issues.append(suggestion)
-                        print(f"發現問題: {suggestion}")
-            except Exception as e:
-                print(f"匹配規則 '{original}' 時出錯: {e}", file=sys.stderr)
-        
-        if found_issues:
-            issues[error_type] = found_issues
+    # 以編譯後的規則引擎單次掃描文章（同一份規則只編譯一次）
+    engine = get_compiled_engine(rules)
+    
+    print(f"成功載入規則，類型數: {len(engine)}")
+    for type_name, rule_count in engine.type_counts:
+        print(f"  - {type_name}: {rule_count} 條規則")
+    
+    issues = engine.find_issues(text, flexible_whitespace=True)
+    for found_issues in issues.values():
+        for suggestion in found_issues:
+            print(f"發現問題: {suggestion}")
     
     # 如果沒有找到任何已知規則的問題，嘗試應用基本英文文法規則
     if not issues:
@@ -154,8 +119,24 @@ def main():
     parser.add_argument('-f', '--file', help='要檢查的文本文件路徑')
     parser.add_argument('-t', '--text', help='直接輸入要檢查的文本')
     parser.add_argument('-r', '--rules', help='文法規則文件路徑')
+    parser.add_argument('--serve', action='store_true', help='以常駐服務模式啟動，保持規則載入於記憶體')
+    parser.add_argument('--port', type=int, default=grammar_daemon.DEFAULT_PORT, help='常駐服務的連接埠')
+    parser.add_argument('--no-daemon', action='store_true', help='不使用常駐服務，直接在本行程中檢查')
+    parser.add_argument('-b', '--batch', help='批次模式：目錄、glob 樣式，或 - 表示從 stdin 讀取 JSONL；每篇輸出一行 JSON')
     args = parser.parse_args()
     
+    if args.serve:
+        grammar_daemon.serve(port=args.port, rules_path=args.rules)
+        return
+    
+    if args.batch:
+        # 規則只載入一次，之後逐篇檢查
+        with contextlib.redirect_stdout(sys.stderr):
+            engine = load_compiled_rules(args.rules)
+        failed = grammar_batch.run_batch(
+            args.batch, lambda text, record: {'success': True, 'issues': check_grammar_issues(text, engine)})
+        sys.exit(1 if failed else 0)
+    
     # 從文件或參數獲取文本
     text = None
     if args.file:
@@ -172,14 +153,23 @@ def main():
         parser.print_help()
         sys.exit(1)
     
-    # 檢測文法問題
-    issues = check_grammar_issues(text, load_grammar_rules(args.rules))
-    
-    # 輸出 JSON 結果
-    result = {
-        'success': True,
-        'issues': issues
-    }
+    # 優先交給常駐服務處理，服務未啟動時才在本行程中載入規則
+    result = None
+    if not args.no_daemon:
+        result = grammar_daemon.request_daemon('score_essay', {
+            'text': text,
+            'rules': os.path.abspath(args.rules) if args.rules else None
+        }, port=args.port)
+    
+    if result is None:
+        # 檢測文法問題
+        issues = check_grammar_issues(text, load_compiled_rules(args.rules))
+        
+        # 輸出 JSON 結果
+        result = {
+            'success': True,
+            'issues': issues
+        }
     
     print("\n結果:")
     print(json.dumps(result, ensure_ascii=False, indent=2))
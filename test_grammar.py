@@ -7,45 +7,34 @@
 import sys
 import os
 import re
-import pickle
 import json
+import contextlib
 
-def load_grammar_rules(file_path=None):
-    """載入儲存的文法規則"""
-    # 如果指定了文件路徑，則使用它
-    if file_path and os.path.exists(file_path):
-        try:
-            print(f"嘗試從指定路徑載入: {file_path}")
-            with open(file_path, 'rb') as f:
-                data = pickle.load(f)
-                if isinstance(data, dict) and "rules" in data:
-                    return data["rules"]
-                return data.get("rules", {})
-        except Exception as e:
-            print(f"無法從指定路徑載入規則: {e}", file=sys.stderr)
-            return {}
-    
-    # 否則嘗試從預設路徑載入
-    possible_paths = [
-        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
-        os.path.join('models', 'grammar_rules.pkl'),
-        os.path.join(os.path.dirname(__file__), '..', 'models', 'grammar_rules.pkl'),
-        os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
-    ]
+import grammar_batch
+from grammar_rule_engine import CompiledRuleEngine, get_compiled_engine, load_rule_engine
+
+# 預設規則路徑
+DEFAULT_RULES_PATHS = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'grammar_rules.pkl'),
+    os.path.join('models', 'grammar_rules.pkl'),
+    os.path.join(os.path.dirname(__file__), '..', 'models', 'grammar_rules.pkl'),
+    os.path.join(os.getcwd(), 'models', 'grammar_rules.pkl')
+]
+
+def load_compiled_rules(file_path=None):
+    """載入編譯後的文法規則（優先使用規則索引檔，避免每次都解開 pickle）"""
+    # 如果指定了文件路徑，則只使用它
+    paths = [file_path] if file_path and os.path.exists(file_path) else DEFAULT_RULES_PATHS
     
-    for path in possible_paths:
+    for path in paths:
         if os.path.exists(path):
             try:
                 print(f"嘗試從路徑載入: {path}")
-                with open(path, 'rb') as f:
-                    data = pickle.load(f)
-                    if isinstance(data, dict) and "rules" in data:
-                        return data["rules"]
-                    return data.get("rules", {})
+                return load_rule_engine(path)
             except Exception as e:
                 print(f"載入文件 {path} 失敗: {e}", file=sys.stderr)
     
-    return {}
+    return CompiledRuleEngine()
 
 def check_grammar_issues(text, rules=None):
     """檢查文本中的文法問題，優化英文文法檢測"""
@@ -53,49 +42,24 @@ def check_grammar_issues(text, rules=None):
     
     # 如果未提供規則，則載入預設規則
     if rules is None:
-        rules = load_grammar_rules()
+        rules = load_compiled_rules()
     
     # 如果沒有規則，則返回空結果
     if not rules:
         print("無法載入任何文法規則")
         return issues
     
-    print(f"成功載入規則，類型數: {len(rules)}")
-    for type_name, type_rules in rules.items():
-        print(f"  - {type_name}: {len(type_rules)} 條規則")
-    
-    # 針對每種錯誤類型檢查
-    for error_type, type_rules in rules.items():
-        found_issues = []
-        for rule in type_rules:
-            # 確保規則格式正確
-            if 'original' not in rule or 'corrected' not in rule or not rule['corrected']:
-                continue
-            
-            original = rule['original']
-            
-            try:
-                # 對於短語類型的錯誤，使用不同的匹配策略
-                if ' ' in original:
-                    # 短語匹配 - 使用完整短語
-                    pattern = r'(?i)\b' + re.escape(original) + r'\b'
-                else:
-                    # 單詞匹配 - 使用單詞邊界
-                    pattern = r'(?i)\b' + re.escape(original) + r'\b'
-                
-                matches = re.findall(pattern, text)
-                
-                if matches:
-                    corrected = rule['corrected'][0]
-                    suggestion = f"'{original}' 可能應為 '{corrected}'"
-                    if suggestion not in found_issues:
-                        found_issues.append(suggestion)
-                        print(f"發現問題: {suggestion}")
-            except Exception as e:
-                print(f"匹配規則 '{original}' 時出錯: {e}", file=sys.stderr)
-        
-        if found_issues:
-            issues[error_type] = found_issues
+    # 以編譯後的規則引擎單次掃描文章（同一份規則只編譯一次）
+    engine = get_compiled_engine(rules)
+    
+    print(f"成功載入規則，類型數: {len(engine)}")
+    for type_name, rule_count in engine.type_counts:
+        print(f"  - {type_name}: {rule_count} 條規則")
+    
+    issues = engine.find_issues(text, flexible_whitespace=False)
+    for found_issues in issues.values():
+        for suggestion in found_issues:
+            print(f"發現問題: {suggestion}")
     
     # 如果沒有找到任何已知規則的問題，嘗試應用基本英文文法規則
     if not issues:
@@ -153,8 +117,21 @@ def main():
     # 檢查是否提供了文本文件
     if len(sys.argv) < 2:
         print("用法: python improve_grammar_check.py <text_file> [rules_file]", file=sys.stderr)
+        print("      python improve_grammar_check.py --batch <目錄|glob|-> [rules_file]", file=sys.stderr)
         sys.exit(1)
     
+    # 批次模式：規則只載入一次，每篇作文輸出一行 JSON
+    if sys.argv[1] == '--batch':
+        if len(sys.argv) < 3:
+            print("請指定批次輸入來源（目錄、glob 樣式或 -）", file=sys.stderr)
+            sys.exit(1)
+        rules_path = sys.argv[3] if len(sys.argv) > 3 else None
+        with contextlib.redirect_stdout(sys.stderr):
+            engine = load_compiled_rules(rules_path)
+        failed = grammar_batch.run_batch(
+            sys.argv[2], lambda text, record: {'success': True, 'issues': check_grammar_issues(text, engine)})
+        sys.exit(1 if failed else 0)
+    
     # 讀取文本文件
     try:
         with open(sys.argv[1], 'r', encoding='utf-8') as f:
@@ -167,7 +144,7 @@ def main():
     rules_path = sys.argv[2] if len(sys.argv) > 2 else None
     
     # 檢測文法問題
-    issues = check_grammar_issues(text, load_grammar_rules(rules_path))
+    issues = check_grammar_issues(text, load_compiled_rules(rules_path))
     
     # 輸出 JSON 結果
     result = {
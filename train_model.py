@@ -19,17 +19,34 @@ import pickle
 import re
 import sys
 import datetime
+import hashlib
 import json
+from sklearn.base import clone
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, cohen_kappa_score
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
 import argparse
+import contextlib
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+from parallel_config import (N_JOBS_ENV, add_n_jobs_argument, apply_n_jobs, effective_n_jobs,
+                             get_n_jobs, set_n_jobs)
 
 # 設置隨機種子確保結果可重現
 np.random.seed(42)
 
+# 特徵提取方式改變時（clean_text、extract_features 或 FEATURE_COLUMNS）必須遞增，舊的特徵快取即失效
+FEATURE_EXTRACTOR_VERSION = 1
+
+# 特徵快取目錄：每個資料集檔案（依內容雜湊）與特徵版本一個 .npz 檔，包含所有 essay_set 的特徵
+FEATURE_CACHE_DIR = os.path.join('models', 'feature_cache')
+
+# 快取中除特徵以外保留的欄位
+FEATURE_CACHE_KEY_COLUMNS = ['essay_id', 'essay_set', 'domain1_score']
+
 def clean_text(text):
     """基本文本清理函數"""
     # 檢查是否為字符串
@@ -83,16 +100,98 @@ def extract_features(text):
     
     return features
 
+# extract_features 產生的特徵欄位（順序即模型的特徵順序）
+FEATURE_COLUMNS = [
+    'char_count', 'word_count', 'sentence_count', 'avg_sentence_length', 'avg_word_length',
+    'lexical_diversity', 'comma_count', 'question_count', 'exclamation_count',
+    'question_ratio', 'exclamation_ratio'
+]
+
+# clean_text 的 ASCII 快速路徑：由相同的正則表達式推導出要刪除的字元與要轉為空格的空白字元，
+# 因此結果與 clean_text 完全相同
+_KEPT_CHAR_RE = re.compile(r'[\w\s\.\,\?\!]')
+_ASCII_DELETE = bytes(b for b in range(128) if not _KEPT_CHAR_RE.match(chr(b)))
+_ASCII_WHITESPACE = bytes(b for b in range(128) if b != 32 and re.match(r'\s', chr(b)))
+_ASCII_SPACE_TABLE = bytes.maketrans(_ASCII_WHITESPACE, b' ' * len(_ASCII_WHITESPACE))
+_MULTI_SPACE_RE = re.compile(r' {2,}')
+
+def _clean_text_fast(text):
+    """與 clean_text 相同；純 ASCII 文本以 bytes.translate 一次完成刪除字元與空白正規化"""
+    if not isinstance(text, str):
+        return ""
+    
+    text = text.lower()
+    if not text.isascii():
+        text = re.sub(r'[^\w\s\.\,\?\!]', '', text)
+        return re.sub(r'\s+', ' ', text).strip()
+    
+    text = text.encode('ascii').translate(_ASCII_SPACE_TABLE, _ASCII_DELETE).decode('ascii')
+    if '  ' in text:
+        text = _MULTI_SPACE_RE.sub(' ', text)
+    return text.strip(' ')
+
+def clean_texts(texts):
+    """clean_text 的整欄版本，結果與逐篇套用 clean_text 相同"""
+    return pd.Series(texts, dtype=object).map(_clean_text_fast)
+
+def _safe_divide(numerator, denominator, fallback):
+    """denominator 為 0 時使用 fallback，其餘為一般除法"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    result = np.asarray(fallback, dtype=float) * np.ones_like(numerator)
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
+
+def extract_features_frame(texts):
+    """
+    extract_features 的整欄版本：一次計算整個欄位的特徵，返回 DataFrame
+    每個值都與逐篇呼叫 extract_features 相同
+    """
+    texts = pd.Series(texts, dtype=object).reset_index(drop=True)
+    
+    # 每篇只切一次詞，同時得到總詞數與不重複詞數
+    word_counts = np.array([(len(words), len(set(words))) for words in (text.split() for text in texts)],
+                           dtype=np.int64).reshape(-1, 2)
+    word_count = word_counts[:, 0]
+    unique_count = word_counts[:, 1]
+    
+    # 基本計數特徵
+    char_count = texts.str.len().to_numpy(dtype=np.int64)
+    comma_count = texts.str.count(',').to_numpy(dtype=np.int64)
+    question_count = texts.str.count(r'\?').to_numpy(dtype=np.int64)
+    exclamation_count = texts.str.count('!').to_numpy(dtype=np.int64)
+    sentence_count = texts.str.count(r'\.').to_numpy(dtype=np.int64) + question_count + exclamation_count
+    
+    return pd.DataFrame({
+        'char_count': char_count,
+        'word_count': word_count,
+        'sentence_count': sentence_count,
+        'avg_sentence_length': _safe_divide(word_count, sentence_count, word_count),
+        'avg_word_length': _safe_divide(char_count, word_count, 0),
+        # 詞彙豐富度 (不重複詞數 / 總詞數)
+        'lexical_diversity': _safe_divide(unique_count, word_count, 0),
+        'comma_count': comma_count,
+        'question_count': question_count,
+        'exclamation_count': exclamation_count,
+        'question_ratio': _safe_divide(question_count, sentence_count, 0),
+        'exclamation_ratio': _safe_divide(exclamation_count, sentence_count, 0)
+    }, columns=FEATURE_COLUMNS)
+
+def resolve_data_path(file_path):
+    """資料集路徑：優先使用項目根目錄下的 data/essays，找不到時使用原本的路徑"""
+    # 修改為檢查相對於項目根目錄的路徑
+    full_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'essays', file_path)
+    
+    if not os.path.exists(full_path):
+        print(f"警告：找不到文件 {full_path}")
+        # 嘗試直接從當前目錄讀取
+        full_path = file_path
+    return full_path
+
 def load_asap_data(file_path):
     """載入 ASAP 資料集"""
     try:
-        # 修改為檢查相對於項目根目錄的路徑
-        full_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'essays', file_path)
-        
-        if not os.path.exists(full_path):
-            print(f"警告：找不到文件 {full_path}")
-            # 嘗試直接從當前目錄讀取
-            full_path = file_path
+        full_path = resolve_data_path(file_path)
             
         # 添加編碼參數
         df = pd.read_csv(full_path, sep='\t', encoding='latin-1')  # 嘗試 latin-1 編碼
@@ -116,8 +215,74 @@ def load_asap_data(file_path):
             print(f"使用 windows-1252 編碼載入失敗: {e2}")
             return pd.DataFrame()
 
-def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None):
-    """訓練模型，可選擇性地包含教師反饋數據"""
+def build_feature_table(df):
+    """清理並提取整個資料集（所有 essay_set）的特徵，返回包含 essay_id、essay_set、分數與特徵的表格"""
+    table = pd.DataFrame({
+        column: df[column].to_numpy() for column in FEATURE_CACHE_KEY_COLUMNS if column in df.columns
+    })
+    features = extract_features_frame(clean_texts(df['essay']))
+    return pd.concat([table, features], axis=1)
+
+def dataset_hash(path):
+    """資料集檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def feature_cache_path(data_hash, cache_dir=FEATURE_CACHE_DIR):
+    return os.path.join(cache_dir, f"features_{data_hash[:16]}_v{FEATURE_EXTRACTOR_VERSION}.npz")
+
+def save_feature_cache(table, path):
+    """每個欄位存成 .npz 中的一個陣列（保留各欄位的數值型別），先寫暫存檔再替換"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, __columns__=np.array(table.columns, dtype=str),
+                 **{column: table[column].to_numpy() for column in table.columns})
+    os.replace(tmp_path, path)
+
+def load_feature_cache(path):
+    with np.load(path, allow_pickle=False) as data:
+        columns = [str(column) for column in data['__columns__']]
+        return pd.DataFrame({column: data[column] for column in columns}, columns=columns)
+
+def load_feature_table(file_path, cache_dir=FEATURE_CACHE_DIR, use_cache=True):
+    """
+    載入資料集的特徵表；同一個資料集檔案與特徵版本只會提取一次特徵
+    快取命中時不必解析 TSV，直接進入模型訓練。無法載入時返回空的 DataFrame。
+    """
+    full_path = resolve_data_path(file_path)
+    cache_path = None
+    if use_cache and os.path.exists(full_path):
+        cache_path = feature_cache_path(dataset_hash(full_path), cache_dir)
+        if os.path.exists(cache_path):
+            try:
+                table = load_feature_cache(cache_path)
+                print(f"使用特徵快取 {cache_path}，共 {len(table)} 筆資料")
+                return table
+            except (OSError, ValueError, KeyError) as e:
+                print(f"特徵快取無法使用，將重新提取特徵: {e}")
+    
+    df = load_asap_data(file_path)
+    if len(df) == 0 or 'essay' not in df.columns:
+        return df
+    
+    table = build_feature_table(df)
+    if cache_path:
+        try:
+            save_feature_cache(table, cache_path)
+            print(f"特徵快取已保存到 {cache_path}")
+        except (OSError, ValueError) as e:
+            print(f"無法保存特徵快取: {e}")
+    return table
+
+def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None, cv_folds=0):
+    """
+    訓練模型，可選擇性地包含教師反饋數據；cv_folds 大於 1 時另在訓練集上做交叉驗證
+    df 可以是原始資料集（含 essay 欄位），或已包含特徵欄位的特徵表（load_feature_table 的結果）
+    """
     if len(df) == 0:
         print("錯誤：資料集為空，無法訓練模型")
         return None, None, 0, 0
@@ -132,9 +297,6 @@ def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None):
     
     print(f"使用 essay_set={essay_set} 的數據進行訓練，共 {len(df)} 筆")
     
-    # 清理文本
-    df['cleaned_essay'] = df['essay'].apply(clean_text)
-    
     # 提取目標變數
     if 'domain1_score' in df.columns:
         y = df['domain1_score'].values
@@ -142,12 +304,11 @@ def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None):
         print("錯誤：資料集缺少目標欄位 'domain1_score'")
         return None, None, 0, 0
     
-    # 提取特徵
-    features_list = []
-    for text in df['cleaned_essay']:
-        features_list.append(extract_features(text))
-    
-    features_df = pd.DataFrame(features_list)
+    # 提取特徵（已是特徵表時直接使用，否則整欄一次計算）
+    if all(column in df.columns for column in FEATURE_COLUMNS):
+        features_df = df[FEATURE_COLUMNS].reset_index(drop=True)
+    else:
+        features_df = extract_features_frame(clean_texts(df['essay']))
     
     # 新增：如果有教師反饋數據，整合到訓練中
     if feedback_data is not None and len(feedback_data) > 0:
@@ -176,7 +337,7 @@ def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None):
         
         if extra_features:
             # 合併原始特徵和額外特徵
-            extra_df = pd.DataFrame(extra_features)
+            extra_df = pd.DataFrame(extra_features, columns=FEATURE_COLUMNS)
             features_df = pd.concat([features_df, extra_df], ignore_index=True)
             
             # 合併原始分數和額外分數
@@ -194,11 +355,21 @@ def train_model(df, essay_set=1, model_version='1.0.0', feedback_data=None):
     model = RandomForestRegressor(
         n_estimators=100,
         max_depth=10,
-        random_state=42
+        random_state=42,
+        n_jobs=get_n_jobs('fit')
     )
     
+    # 交叉驗證（平行處理各折時，每折內的模型只用一個核心，避免核心超額分配）
+    if cv_folds and cv_folds > 1:
+        cv_n_jobs = get_n_jobs('cv')
+        cv_model = clone(model).set_params(n_jobs=1) if cv_n_jobs != 1 else model
+        cv_scores = cross_val_score(cv_model, X_train, y_train, cv=cv_folds,
+                                    scoring='neg_root_mean_squared_error', n_jobs=cv_n_jobs)
+        print(f"{cv_folds} 折交叉驗證 RMSE: {-cv_scores.mean():.4f} (±{cv_scores.std():.4f})")
+    
     # 訓練
     model.fit(X_train, y_train)
+    apply_n_jobs(model, 'predict')
     
     # 評估模型
     y_pred = model.predict(X_test)
@@ -259,20 +430,133 @@ def save_model(model, feature_names, rmse, kappa, essay_set, version="1.0.0"):
     
     return training_info
 
+def parse_essay_set(value):
+    """--essay_set 參數：整數或 'all'（所有 essay_set 各訓練一個模型）"""
+    if str(value).lower() == 'all':
+        return 'all'
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"essay_set 必須是整數或 'all': {value}")
+
+def set_model_version(version, essay_set):
+    """--essay_set all 時各 essay_set 模型的版本號，例如 1.0.0_set3"""
+    return f"{version}_set{essay_set}"
+
+def _init_set_worker():
+    """每個 essay_set 在獨立行程中訓練，行程內的擬合與交叉驗證只用一個核心，避免核心超額分配"""
+    for role in ('fit', 'cv'):
+        os.environ[f"{N_JOBS_ENV}_{role.upper()}"] = '1'
+
+def _train_set(table, essay_set, version, feedback_data, cv_folds):
+    """
+    訓練並保存單一 essay_set 的模型，返回 (essay_set, 訓練記錄或 None, 輸出內容, 錯誤訊息或 None)
+    訓練中的例外不會拋出，以錯誤訊息返回，其他 essay_set 照常訓練
+    """
+    output = io.StringIO()
+    training_info = None
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            model, feature_names, rmse, kappa = train_model(table, essay_set, version, feedback_data, cv_folds)
+            if model is None:
+                error = '模型訓練失敗'
+            else:
+                training_info = save_model(model, feature_names, rmse, kappa, essay_set,
+                                           set_model_version(version, essay_set))
+                training_info['dataset_size'] = len(table)
+        except Exception as e:
+            training_info = None
+            error = f"{type(e).__name__}: {e}"
+            print(f"訓練 essay_set={essay_set} 時發生錯誤: {error}")
+    return essay_set, training_info, output.getvalue(), error
+
+def train_all_sets(table, version='1.0.0', feedback_data=None, cv_folds=0):
+    """
+    特徵表只載入一次，以行程池平行訓練每個 essay_set 的模型並保存，
+    總時間取決於最慢的 essay_set，而不是所有 essay_set 的總和。
+    另外寫入合併的訓練記錄 training_record_v{version}.json（含各 essay_set 的 RMSE/QWK）
+    """
+    started = time.perf_counter()
+    essay_sets = sorted(int(s) for s in table['essay_set'].dropna().unique())
+    workers = min(len(essay_sets), effective_n_jobs(get_n_jobs('fit')))
+    print(f"共 {len(essay_sets)} 個 essay_set，使用 {workers} 個行程平行訓練")
+
+    # 每個行程只傳入該 essay_set 的資料
+    tasks = [(table[table['essay_set'] == essay_set], essay_set, version, feedback_data, cv_folds)
+             for essay_set in essay_sets]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_set_worker) as pool:
+            futures = [(task[1], pool.submit(_train_set, *task)) for task in tasks]
+            results = []
+            for essay_set, future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # worker 行程異常結束等無法在 _train_set 中攔截的錯誤
+                    results.append((essay_set, None, '', f"{type(e).__name__}: {e}"))
+    else:
+        results = [_train_set(*task) for task in tasks]
+
+    sets = []
+    failed_sets = []
+    for essay_set, training_info, output, error in results:
+        print(f"\n===== essay_set {essay_set} =====")
+        print(output, end='')
+        if training_info is None:
+            failed_sets.append({'essay_set': essay_set, 'error': error})
+        else:
+            sets.append(training_info)
+
+    combined = {
+        'model_version': version,
+        'training_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'essay_set': 'all',
+        'rmse': float(np.mean([info['rmse'] for info in sets])) if sets else 0,
+        'kappa': float(np.mean([info['kappa'] for info in sets])) if sets else 0,
+        'feature_count': sets[0]['feature_count'] if sets else 0,
+        'dataset_size': int(sum(info['dataset_size'] for info in sets)),
+        'sets': sets,
+        'failed_sets': failed_sets,
+        'elapsed_seconds': round(time.perf_counter() - started, 2)
+    }
+
+    if not os.path.exists('models'):
+        os.makedirs('models')
+    record_path = f'models/training_record_v{version}.json'
+    with open(record_path, 'w', encoding='utf-8') as f:
+        json.dump(combined, f, ensure_ascii=False, indent=2)
+
+    print("\n各 essay_set 評估結果:")
+    for info in sets:
+        print(f"essay_set {info['essay_set']}: RMSE={info['rmse']:.4f}, QWK={info['kappa']:.4f} ({info['dataset_size']} 筆)")
+    for failed in failed_sets:
+        print(f"essay_set {failed['essay_set']} 訓練失敗: {failed['error']}")
+    print(f"合併訓練記錄已保存到 {record_path}（耗時 {combined['elapsed_seconds']} 秒）")
+
+    return combined
+
 def main():
     """主函數"""
     parser = argparse.ArgumentParser(description='訓練作文評分模型')
     parser.add_argument('--data', default='training_set_rel3.tsv', help='資料集文件路徑')
     parser.add_argument('--feedback', help='教師反饋數據JSON文件路徑')
-    parser.add_argument('--essay_set', type=int, default=1, help='使用哪個 essay_set 進行訓練')
+    parser.add_argument('--essay_set', type=parse_essay_set, default=1,
+                        help="使用哪個 essay_set 進行訓練（'all' 為每個 essay_set 各訓練一個模型）")
     parser.add_argument('--version', default='1.0.0', help='模型版本')
+    parser.add_argument('--cv', type=int, default=0, help='交叉驗證折數 (0 為不做交叉驗證)')
+    parser.add_argument('--no_feature_cache', action='store_true', help='不使用特徵快取（每次重新提取特徵）')
+    add_n_jobs_argument(parser)
     
     args = parser.parse_args()
     
+    if args.n_jobs is not None:
+        set_n_jobs(args.n_jobs)
+    
     print("開始訓練作文評分模型...")
     
-    # 載入資料
-    df = load_asap_data(args.data)
+    # 載入資料（特徵快取命中時直接載入特徵表）
+    df = load_feature_table(args.data, use_cache=not args.no_feature_cache)
     
     if len(df) == 0:
         print("無法載入資料集，訓練終止")
@@ -288,8 +572,31 @@ def main():
         except Exception as e:
             print(f"載入反饋數據失敗: {e}")
     
+    feedback_count = len(feedback_data) if feedback_data else 0
+    
+    # 所有 essay_set 一次訓練
+    if args.essay_set == 'all':
+        combined = train_all_sets(df, args.version, feedback_data, args.cv)
+        if not combined['sets']:
+            print("模型訓練失敗")
+            return
+        print("\n資料庫記錄 SQL:")
+        for info in combined['sets']:
+            print(f"""
+    INSERT INTO model_training 
+    (model_version, training_date, dataset_size, accuracy, notes) 
+    VALUES 
+    ('{info['model_version']}', 
+     '{info['training_date']}', 
+     {info['dataset_size']}, 
+     {info['kappa']}, 
+     'Trained on essay_set {info['essay_set']} with {feedback_count} teacher feedback items')
+    """)
+        print("\n訓練完成！")
+        return
+    
     # 訓練模型
-    model, feature_names, rmse, kappa = train_model(df, args.essay_set, args.version, feedback_data)
+    model, feature_names, rmse, kappa = train_model(df, args.essay_set, args.version, feedback_data, args.cv)
     
     if model is None:
         print("模型訓練失敗")
@@ -299,7 +606,6 @@ def main():
     training_info = save_model(model, feature_names, rmse, kappa, args.essay_set, args.version)
     
     # 創建資料庫記錄所需的 SQL
-    feedback_count = len(feedback_data) if feedback_data else 0
     sql = f"""
     INSERT INTO model_training 
     (model_version, training_date, dataset_size, accuracy, notes) 
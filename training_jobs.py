@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+背景訓練工作 - 讓訓練 API 立即返回，不佔用處理批改請求的 worker
+
+TrainingJobRunner.submit(target) 在背景執行緒執行 target(job) 並立即返回工作 id；
+target 透過 job.update(...) 回報目前階段、範例數與評估指標。
+工作狀態寫入狀態目錄中的 <工作 id>.json，因此任何一個 worker 行程都能查詢。
+
+同一時間只允許一個訓練工作：以鎖定檔 (O_CREAT | O_EXCL) 在行程之間互斥，
+工作結束後刪除；持有鎖定的行程已不存在，或鎖定檔超過 lock_timeout 秒時視為失效。
+檢查與移除失效鎖定都在 training.lock.guard 的檔案鎖內進行，兩個行程不會同時接手；
+失效鎖定對應的工作若仍未結束，會標記為 failed。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from feedback_store import file_lock
+
+# 鎖定檔超過此秒數視為失效（例如訓練中的行程被強制結束）
+DEFAULT_LOCK_TIMEOUT = float(os.environ.get('TRAINING_LOCK_TIMEOUT', str(6 * 3600)))
+
+# 工作結束的階段
+FINISHED_PHASES = ('completed', 'failed')
+
+# Windows 查詢行程狀態用的常數
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_INVALID_PARAMETER = 87
+STILL_ACTIVE = 259
+
+
+def pid_alive(pid):
+    """檢查行程是否仍在執行（無法確定時視為執行中）"""
+    if not isinstance(pid, int) or pid <= 0:
+        return True
+    if os.name == 'nt':
+        # Windows 的 os.kill 會結束行程，改以 OpenProcess 查詢結束代碼
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # 行程不存在時 OpenProcess 失敗並回報 ERROR_INVALID_PARAMETER
+            return kernel32.GetLastError() != ERROR_INVALID_PARAMETER
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 例如 PermissionError：行程存在但屬於其他使用者
+        return True
+    return True
+
+
+class TrainingBusyError(RuntimeError):
+    """已有訓練工作執行中"""
+
+    def __init__(self, job_id):
+        super().__init__(f"Training job {job_id} is already running")
+        self.job_id = job_id
+
+
+class TrainingJob:
+    """單一訓練工作的狀態，每次 update 都會寫回狀態檔"""
+
+    def __init__(self, job_id, status_path):
+        self.id = job_id
+        self.status_path = status_path
+        self._started = time.monotonic()
+        self.status = {
+            'job_id': job_id,
+            'phase': 'queued',
+            'examples': 0,
+            'metrics': {},
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': 0.0
+        }
+        self._write()
+
+    def update(self, **fields):
+        """更新階段、範例數、指標等欄位"""
+        self.status.update(fields)
+        self.status['elapsed'] = round(time.monotonic() - self._started, 2)
+        self._write()
+
+    def _write(self):
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.status, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+
+class TrainingJobRunner:
+    """一次執行一個背景訓練工作"""
+
+    def __init__(self, status_dir, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self.status_dir = status_dir
+        self.lock_path = os.path.join(status_dir, 'training.lock')
+        self.guard_path = f"{self.lock_path}.guard"
+        self.lock_timeout = lock_timeout
+        os.makedirs(status_dir, exist_ok=True)
+
+    def _status_path(self, job_id):
+        return os.path.join(self.status_dir, f"{job_id}.json")
+
+    def _acquire_lock(self, job_id):
+        """取得訓練鎖定；已有工作執行中時引發 TrainingBusyError"""
+        # 其他行程取得或釋放鎖定時都持有 guard，檢查、移除失效鎖定與建立新鎖定之間不會被插入
+        with file_lock(self.guard_path):
+            try:
+                fd = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                lock = self._read_lock()
+                running = self._lock_owner(lock)
+                if running is not None:
+                    raise TrainingBusyError(running)
+                # 鎖定檔已失效：原本的工作標記為失敗後移除鎖定
+                self._abandon_job(lock)
+                os.remove(self.lock_path)
+                fd = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'job_id': job_id, 'pid': os.getpid(), 'locked_at': time.time()}, f)
+
+    def _read_lock(self):
+        """讀取鎖定檔內容；不存在時返回 None，無法解析時返回空字典"""
+        try:
+            with open(self.lock_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return {}
+
+    def _lock_owner(self, lock=None):
+        """返回持有鎖定的工作 id；鎖定檔已失效時返回 None"""
+        if lock is None:
+            lock = self._read_lock()
+            if lock is None:
+                return None
+        if not lock:
+            # 內容不完整（寫入鎖定的行程在寫完之前結束），只能等逾時
+            try:
+                locked_at = os.path.getmtime(self.lock_path)
+            except OSError:
+                return None
+            return None if time.time() - locked_at > self.lock_timeout else 'unknown'
+
+        if time.time() - lock.get('locked_at', 0) > self.lock_timeout:
+            return None
+        if not pid_alive(lock.get('pid')):
+            # 持有鎖定的行程已結束（例如被強制結束），不必等到逾時
+            return None
+        job_status = self.get(lock.get('job_id'))
+        if job_status and job_status.get('phase') in FINISHED_PHASES:
+            return None
+        return lock.get('job_id')
+
+    def _abandon_job(self, lock):
+        """失效鎖定對應的工作若仍顯示執行中，改為 failed"""
+        job_id = (lock or {}).get('job_id')
+        status = self.get(job_id)
+        if not status or status.get('phase') in FINISHED_PHASES:
+            return
+        status.update(phase='failed', error='Training process exited before the job finished',
+                      finished_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            tmp_path = f"{self._status_path(job_id)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._status_path(job_id))
+        except OSError as e:
+            print(f"無法更新工作 {job_id} 的狀態: {e}", file=sys.stderr)
+
+    def _release_lock(self, job_id):
+        with file_lock(self.guard_path):
+            lock = self._read_lock()
+            if lock and lock.get('job_id') == job_id:
+                try:
+                    os.remove(self.lock_path)
+                except OSError:
+                    pass
+
+    def submit(self, target):
+        """
+        啟動背景工作並返回工作 id；target(job) 返回的字典會合併進最終狀態
+        已有工作執行中時引發 TrainingBusyError
+        """
+        job_id = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self._acquire_lock(job_id)
+        try:
+            job = TrainingJob(job_id, self._status_path(job_id))
+        except Exception:
+            self._release_lock(job_id)
+            raise
+
+        thread = threading.Thread(target=self._run, args=(job, target), name=f'training-{job_id}', daemon=True)
+        thread.start()
+        return job_id
+
+    def _run(self, job, target):
+        try:
+            job.update(phase='running', started_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+            result = target(job) or {}
+            job.update(phase='completed', finished_at=time.strftime('%Y-%m-%d %H:%M:%S'), **result)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            job.update(phase='failed', error=str(e), finished_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+        finally:
+            self._release_lock(job.id)
+
+    def get(self, job_id):
+        """讀取工作狀態；工作不存在時返回 None"""
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        try:
+            with open(self._status_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def latest(self):
+        """最近一個工作的狀態（工作 id 以時間開頭，依名稱排序即為建立順序）"""
+        job_ids = sorted(name[:-5] for name in os.listdir(self.status_dir)
+                         if name.endswith('.json'))
+        return self.get(job_ids[-1]) if job_ids else None